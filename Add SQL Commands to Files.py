@@ -21,9 +21,17 @@ Usage:
 Features:
     - Allows specification of multiple SQL code block options for different use cases.
     - Prepends chosen SQL code block to the beginning of each .sql file in the specified directories.
-    - Handles file encodings ('utf-8-sig', 'utf-8', 'latin-1') to accommodate files from different sources.
+    - Handles file encodings ('utf-8-sig', 'utf-8', 'latin-1') to accommodate files from different sources,
+      reading each file only once to detect its encoding.
     - Checks if a file already starts with one of the options and, if so, replaces it with the chosen option to avoid duplication.
-    - Provides feedback on the processing of each file, including the file path and encoding used.
+      Only a block at the very top of the file is replaced; identical text further down is left untouched.
+    - Detects an existing header from the first few kilobytes of each file. Files that already start with the
+      chosen block are skipped without reading the rest, so a re-run over an up-to-date tree does almost no I/O.
+    - Streams the new header and the rest of the file to disk instead of building the new contents in memory.
+    - Provides feedback on the processing of each file, including the file path and whether it changed.
+    - Processes files in parallel ('workers') and replaces each file atomically, so an interrupted run never
+      leaves a truncated file. Files that already have the chosen block are not rewritten.
+    - Supports a dry run ('dry_run') that reports the files that would change without touching disk.
 
 Note:
     Before running this script, ensure that you have backups of your .sql files, as this process modifies the files in place.
@@ -54,46 +62,101 @@ EXECUTE sp_babelfish_configure '%', 'ignore', 'server'--Babelfish addition: Sett
 GO
 """
 }
-import os
+import io
 import re
+import shutil
+import codecs
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from sql_file_utils import atomic_writer, detect_encoding, find_sql_files
 
-def prepend_code_block_with_encoding_handling(directories, chosen_option, encodings, options):
+def header_is_current(file_path, header, encodings, prefix_size=4096):
     """
-    Prepends a given code block to all .sql files in the specified directories,
-    taking into account the file's encoding to handle UTF properly.
+    Returns True if the file already starts with 'header' followed by non-whitespace text (or nothing
+    at all), reading only the first few kilobytes of the file.
     """
-    combined_options_pattern = re.compile('|'.join(re.escape(opt) for opt in options.values()), re.DOTALL)
+    prefix_size = max(prefix_size, 2 * len(header.encode('utf-8')) + 8)
+    with open(file_path, 'rb') as file:
+        prefix = file.read(prefix_size)
+    at_end = len(prefix) < prefix_size
 
-    for directory in directories:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.endswith(".sql"):
-                    file_path = os.path.join(root, file)
-                    file_content, encoding_used = read_file_with_encoding_detection(file_path, encodings)
-
-                    # Check if the file content starts with any of the options
-                    if combined_options_pattern.match(file_content):
-                        new_content = combined_options_pattern.sub('', file_content).lstrip()
-                        new_content = chosen_option.rstrip() + "\n\n" + new_content
-                    else:
-                        new_content = chosen_option.rstrip() + "\n\n" + file_content
-
-                    with open(file_path, 'w', encoding=encoding_used) as f:
-                        f.write(new_content)
-                    print(f"Processed {file_path} with encoding {encoding_used}")
-
-def read_file_with_encoding_detection(file_path, encodings):
-    """
-    Attempts to read a file with multiple encodings until one succeeds.
-    Returns the file content and the encoding used.
-    """
+    # Decode the prefix with the first encoding that can decode it; a multi-byte character cut off
+    # at the end of the prefix is not an error
     for encoding in encodings:
         try:
-            with open(file_path, 'r', encoding=encoding) as file:
-                return file.read(), encoding
+            text = codecs.getincrementaldecoder(encoding)().decode(prefix, final=at_end)
+            break
         except UnicodeDecodeError:
             continue
-    raise ValueError(f"Failed to decode {file_path} with given encodings.")
+    else:
+        return False
+
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if not text.startswith(header):
+        return False
+    rest = text[len(header):]
+    return not rest[0].isspace() if rest else at_end
+
+def prepend_code_block(file_path, chosen_option, encodings, combined_options_pattern, max_option_length,
+                       dry_run=False, block_size=1024 * 1024):
+    """
+    Puts the chosen code block at the top of a file. Files whose header already equals the chosen block
+    are recognised from a bounded prefix and left alone. Otherwise an option block at the very top (if
+    any) is replaced by the chosen block, and the rest of the file is streamed into a temporary file in
+    the file's original encoding, which then replaces the file.
+    Returns (file_path, status, error).
+    """
+    header = chosen_option.rstrip() + "\n\n"
+    try:
+        if header_is_current(file_path, header, encodings):
+            return file_path, 'unchanged', None
+        if dry_run:
+            return file_path, 'would update', None
+
+        encoding = detect_encoding(file_path, encodings)
+        # The source is closed before the temporary file replaces it (required on Windows)
+        with atomic_writer(file_path) as target, open(file_path, 'r', encoding=encoding) as source:
+            output = io.TextIOWrapper(target, encoding=encoding)
+            output.write(header)
+
+            # Only an option block at the very top of the file is removed, with the whitespace after it
+            body = source.read(max_option_length)
+            match = combined_options_pattern.match(body)
+            if match:
+                body = body[match.end():].lstrip()
+                while not body:
+                    chunk = source.read(block_size)
+                    if not chunk:
+                        break
+                    body = chunk.lstrip()
+            output.write(body)
+            shutil.copyfileobj(source, output, block_size)
+
+            output.flush()
+            output.detach()
+        return file_path, 'updated', None
+    except Exception as e:
+        return file_path, 'error', e
+
+def prepend_code_block_with_encoding_handling(directories, chosen_option, encodings, options, workers=8, dry_run=False):
+    """
+    Prepends a given code block to all .sql files in the specified directories,
+    taking into account the file's encoding to handle UTF properly.
+    Files are processed by 'workers' threads and replaced atomically; files whose header already
+    equals the chosen block are only read up to their first few kilobytes and are not rewritten.
+    With 'dry_run' the files that would change are only reported.
+    """
+    combined_options_pattern = re.compile('|'.join(re.escape(opt) for opt in options.values()), re.DOTALL)
+    prepend = partial(prepend_code_block, chosen_option=chosen_option, encodings=encodings,
+                      combined_options_pattern=combined_options_pattern,
+                      max_option_length=max(len(opt) for opt in options.values()), dry_run=dry_run)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for file_path, status, error in executor.map(prepend, find_sql_files(directories)):
+            if status == 'error':
+                print(f"Error processing {file_path}: {error}")
+            else:
+                print(f"Processed {file_path}: {status}")
 
 if __name__ == "__main__":
     encodings = ['utf-8-sig', 'utf-8', 'latin-1']
@@ -105,6 +168,8 @@ if __name__ == "__main__":
     code_block = options[option_to_use]
 
     directories = []
+    workers = 8  # Number of files processed at the same time
+    dry_run = False  # Set to True to only report which files would change
 
-    prepend_code_block_with_encoding_handling(directories, code_block, encodings, options)
+    prepend_code_block_with_encoding_handling(directories, code_block, encodings, options, workers, dry_run)
     print("Done processing .sql files.")
@@ -8,9 +8,26 @@ Features:
 - Traverses a specified directory to find SQL files.
 - Executes Babelfish Compass commands for each found SQL file.
 - Inserts operation data into the bbfcompass_history table in a PostgreSQL database.
+- Batches many SQL files into one Compass report ('batch_size', or one report per directory with
+  'group_by_directory'), so Compass is started twice per batch instead of twice per file. Batches are also
+  split before the command line (command, report name and file paths) gets too long ('max_command_length').
+- Every report name carries a run id (the start time of the run, e.g. 'batch_20240115_120000_0001'), so a
+  run never reuses the report of an earlier run. A CSV mapping each run id and report back to its source
+  files is written to 'mapping_file'.
+- Runs Compass through a pluggable runner and a configurable 'compass_command', so a local fake Compass
+  command can be used for tests and benchmarks.
+- Analyzes up to 'workers' reports at the same time, each under its own report name. Imports and history
+  writes are serialized and share one PostgreSQL connection held open for the whole run.
+- Handles errors per report: a failing Compass run is reported and skipped instead of stopping the run.
+- Appends only the rows of the latest import to bbfcompass_history ('history_mode'): either the rows of the
+  imported report ('report', keyed on 'history_column', e.g. report_name; as report names carry the run id,
+  only the current run's rows match, and a report already in the history is never copied again) or the rows
+  above the history's high-water mark ('watermark', e.g. a date_imported or serial column). 'full' copies the
+  whole bbfcompass table as before, which duplicates earlier imports every time.
 
 Usage:
 Set the `user_provided_directory` and `babelfish_compass_directory` variables to the respective directories before running the script.
+Set `batch_size` to the number of files per Compass report (1 runs Compass once per file, as before).
 
 Requirements:
 - Python 3.6 or later
@@ -20,52 +37,228 @@ Requirements:
 """
 
 import os
+import csv
+import datetime
+import threading
 import subprocess
-import psycopg2
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sql_file_utils import find_sql_files
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
 
 # Hardcoded directory paths
 user_provided_directory = r"C:\\...."
 babelfish_compass_directory = r"C:\\BabelfishCompass"
 
-def run_babelfish_commands(sql_file, babelfish_compass_directory):
-    # Extract the file name without extension
-    file_name_without_extension = os.path.splitext(os.path.basename(sql_file))[0]
-
-    # Define the command for processing the SQL file
-    process_command = f'BabelfishCompass.bat {file_name_without_extension} {sql_file}'
-    import_command = f'BabelfishCompass.bat {file_name_without_extension} -pgimport "localhost,5432,postgres,password!,test_db"'
-
-    # Run the commands from the specified BabelfishCompass directory
-    subprocess.run(process_command, shell=True, check=True, cwd=babelfish_compass_directory)
-    subprocess.run(import_command, shell=True, check=True, cwd=babelfish_compass_directory)
-
-def insert_into_bbfcompass_history():
-    # Connect to your PostgreSQL database
-    conn = psycopg2.connect(host="localhost", database="test_db", user="postgres", password="password!")
-    cur = conn.cursor()
-
-    # SQL statement to be executed
-    insert_sql = "INSERT INTO public.bbfcompass_history SELECT * FROM public.bbfcompass;"
-    
-    cur.execute(insert_sql)
-    conn.commit()
-
-    # Close the database connection
-    cur.close()
-    conn.close()
-
-def process_sql_files(directory, babelfish_compass_directory):
-    # Loop through all files in the directory
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".sql"):
-                sql_file_path = os.path.join(root, file)
-                print(f"Processing {sql_file_path}...")
-                # Run Babelfish Compass commands with the variable directory
-                run_babelfish_commands(sql_file_path, babelfish_compass_directory)
-                # Insert data into bbfcompass_history
-                insert_into_bbfcompass_history()
-                print(f"Completed processing {sql_file_path}.")
+# Compass executable (run from babelfish_compass_directory) and the -pgimport connection string
+compass_command = ['BabelfishCompass.bat']
+pgimport_connection = "localhost,5432,postgres,password!,test_db"
+
+batch_size = 200  # Number of .sql files analyzed per Compass report; 1 runs Compass once per file
+group_by_directory = False  # Set to True to never mix files of different directories in one report
+max_command_length = 8000  # Split batches before the command line exceeds this length (cmd.exe allows 8191)
+report_prefix = 'batch'  # Name prefix of multi-file reports
+workers = 4  # Number of Compass analyses running at the same time
+
+# How imports are appended to the history: 'report' copies the rows whose history_column equals the report name,
+# 'watermark' copies the rows whose history_column is above the highest value already in the history, and
+# 'full' copies the whole bbfcompass table (the original behaviour, which duplicates earlier imports)
+history_mode = 'report'
+history_column = 'report_name'
+mapping_file = r"C:\\BabelfishCompass\\report_file_mapping.csv"  # Report name -> source file mapping
+
+def run_command(command, cwd):
+    """Run one Compass command from 'cwd', raising CalledProcessError if it fails."""
+    # BabelfishCompass.bat is started through cmd.exe on Windows, as 'shell=True' did before
+    subprocess.run(command, shell=(os.name == 'nt'), check=True, cwd=cwd)
+
+def babelfish_commands(report_name, sql_files):
+    """Return the command analyzing the SQL files into one Compass report and the command importing it."""
+    process_command = [*compass_command, report_name, *sql_files]
+    import_command = [*compass_command, report_name, '-pgimport', pgimport_connection]
+    return process_command, import_command
+
+def make_batches(sql_files, batch_size=200, group_by_directory=False, max_command_length=8000, reserved_length=0):
+    """
+    Split the SQL files into batches of at most 'batch_size' files. With 'group_by_directory' each
+    batch only holds files of one directory. A batch is also closed early once the file paths would
+    make the Compass command line longer than 'max_command_length' characters, of which
+    'reserved_length' are taken by the command and the report name (see command_prefix_length).
+    """
+    if group_by_directory:
+        groups = [list(files) for _, files in groupby(sql_files, key=os.path.dirname)]
+    else:
+        groups = [list(sql_files)]
+
+    for files in groups:
+        batch, length = [], reserved_length
+        for sql_file in files:
+            if batch and (len(batch) >= max(batch_size, 1) or length + len(sql_file) + 3 > max_command_length):
+                yield batch
+                batch, length = [], reserved_length
+            batch.append(sql_file)
+            length += len(sql_file) + 3  # Path plus quotes and a separating space
+        if batch:
+            yield batch
+
+def new_run_id():
+    """Return the id of a new run: its start time, down to the second."""
+    return datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+
+def command_prefix_length(run_id, batch_count):
+    """
+    Return the length of the Compass command line before the first file path: the command and the
+    name of a multi-file report of the run, plus the separating spaces.
+    """
+    report_name = f"{report_prefix}_{run_id}_{max(batch_count, 1):04d}"
+    return len(subprocess.list2cmdline([*compass_command, report_name])) + 1
+
+def report_names(batches, run_id):
+    """
+    Name each report after its file when it holds a single file, otherwise after the batch number,
+    followed by the run id so no two runs share a report. Names are made unique with a numeric
+    suffix so concurrent Compass runs never share a report.
+    """
+    names, used = [], set()
+    for batch_number, batch in enumerate(batches, start=1):
+        if len(batch) == 1:
+            # Extract the file name without extension
+            name = f"{os.path.splitext(os.path.basename(batch[0]))[0]}_{run_id}"
+        else:
+            name = f"{report_prefix}_{run_id}_{batch_number:04d}"
+        unique_name, suffix = name, 2
+        while unique_name.lower() in used:
+            unique_name = f"{name}_{suffix}"
+            suffix += 1
+        used.add(unique_name.lower())
+        names.append(unique_name)
+    return names
+
+def write_mapping(mapping_file, run_id, report_name, batch):
+    """Append the run id, the report name and each of its source files to the mapping CSV."""
+    new_file = not os.path.exists(mapping_file)
+    with open(mapping_file, 'a', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        if new_file:
+            writer.writerow(['RunId', 'ReportName', 'FilePath'])
+        writer.writerows((run_id, report_name, sql_file) for sql_file in batch)
+
+def connect_postgres():
+    """Connect to the PostgreSQL database holding the Compass tables."""
+    if psycopg2 is None:
+        raise ValueError("The 'psycopg2' module is required to record the history. Install it with 'pip install psycopg2'.")
+    return psycopg2.connect(host="localhost", database="test_db", user="postgres", password="password!")
+
+def history_insert_sql(mode='report', column='report_name', source_table='public.bbfcompass',
+                       history_table='public.bbfcompass_history', placeholder='%s'):
+    """
+    Build the statement appending the latest import to the history table. In 'report' mode it takes
+    the report name twice as its parameters and copies nothing if the report is already in the
+    history. Only portable SQL is used, so the statement can be tried against SQLite (with
+    placeholder '?') as well as PostgreSQL.
+    """
+    if mode == 'report':
+        return (f"INSERT INTO {history_table} SELECT * FROM {source_table} WHERE {column} = {placeholder} "
+                f"AND NOT EXISTS (SELECT 1 FROM {history_table} WHERE {column} = {placeholder});")
+    elif mode == 'watermark':
+        return (f"INSERT INTO {history_table} SELECT * FROM {source_table} "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {history_table}) "
+                f"OR {column} > (SELECT MAX({column}) FROM {history_table});")
+    elif mode == 'full':
+        return f"INSERT INTO {history_table} SELECT * FROM {source_table};"
+    else:
+        raise ValueError("Unsupported history mode specified.")
+
+class HistoryRecorder:
+    """
+    Copies imported Compass data into bbfcompass_history over a single connection that stays open
+    for the whole run, instead of opening a new connection for every import. Only the rows of the
+    latest import are copied (see history_insert_sql).
+    """
+    def __init__(self, connect=connect_postgres, mode='report', column='report_name', source_table='public.bbfcompass',
+                 history_table='public.bbfcompass_history', placeholder='%s'):
+        self.conn = connect()
+        self.mode = mode
+        # SQL statement to be executed
+        self.insert_sql = history_insert_sql(mode, column, source_table, history_table, placeholder)
+
+    def record(self, report_name):
+        """Append the rows imported for the report to the history."""
+        cur = self.conn.cursor()
+        try:
+            cur.execute(self.insert_sql, (report_name, report_name) if self.mode == 'report' else ())
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def close(self):
+        self.conn.close()
+
+def process_sql_files(directory, babelfish_compass_directory, batch_size=1, group_by_directory=False,
+                      max_command_length=8000, mapping_file=None, workers=1, runner=run_command, history=None):
+    """
+    Run Compass over all .sql files in the directory, one report per batch of files, and record the
+    history once per batch. Up to 'workers' reports are analyzed at the same time; the imports and
+    history writes run one at a time, so each import is copied to the history before the next one
+    starts. 'runner' runs one command (see run_command) and 'history' records an import (a
+    HistoryRecorder by default); both can be replaced, e.g. by fakes for testing.
+    A failing report is reported and skipped. Returns the list of (report_name, files, error) for
+    the reports that failed.
+    """
+    run_id = new_run_id()
+    sql_files = list(find_sql_files([directory]))
+    # The batch count is not known yet; the file count is an upper bound for the batch number
+    reserved_length = command_prefix_length(run_id, len(sql_files))
+    batches = list(make_batches(sql_files, batch_size, group_by_directory, max_command_length, reserved_length))
+    names = report_names(batches, run_id)
+    if mapping_file:
+        for report_name, batch in zip(names, batches):
+            write_mapping(mapping_file, run_id, report_name, batch)
+
+    own_history = history is None
+    if own_history:
+        history = HistoryRecorder(mode=history_mode, column=history_column)
+    import_lock = threading.Lock()
+
+    def process_batch(report_name, batch):
+        process_command, import_command = babelfish_commands(report_name, batch)
+        # Run the commands from the specified BabelfishCompass directory
+        runner(process_command, babelfish_compass_directory)
+        with import_lock:
+            runner(import_command, babelfish_compass_directory)
+            # Insert data into bbfcompass_history
+            history.record(report_name)
+
+    failures = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {}
+            for report_name, batch in zip(names, batches):
+                print(f"Processing {len(batch)} files as report {report_name}..." if len(batch) > 1 else f"Processing {batch[0]}...")
+                futures[executor.submit(process_batch, report_name, batch)] = (report_name, batch)
+            for future in as_completed(futures):
+                report_name, batch = futures[future]
+                error = future.exception()
+                if error:
+                    failures.append((report_name, batch, error))
+                    print(f"Error processing report {report_name} ({len(batch)} files): {error}")
+                else:
+                    print(f"Completed processing report {report_name}.")
+    finally:
+        if own_history:
+            history.close()
+
+    print(f"Run {run_id}: processed {len(batches) - len(failures)} of {len(batches)} reports" +
+          (f"; {len(failures)} failed" if failures else "."))
+    return failures
 
 if __name__ == "__main__":
-    process_sql_files(user_provided_directory, babelfish_compass_directory)
+    process_sql_files(user_provided_directory, babelfish_compass_directory, batch_size, group_by_directory,
+                      max_command_length, mapping_file, workers)
@@ -4,53 +4,301 @@ SQLCMD Script Generator
 Description:
     This script generates an SQLCMD script to execute .sql files found within specified directories.
     It automatically traverses through each directory, compiles commands to execute found .sql files,
-    and copies the final SQLCMD script to the clipboard.
+    and writes the final SQLCMD script to a file, to stdout or to the clipboard.
 
 Usage:
     Modify the 'directories' list in the '__main__' section to include the paths to the directories
-    containing your .sql files. 
+    containing your .sql files. Set 'output_file' to write the script to a file, or leave it at None to
+    print it (or copy it to the clipboard with 'copy_to_clipboard').
+    Set 'shards' above 1 to split the files into that many scripts that can run in parallel sqlcmd sessions.
+    Set 'dependency_order' to True to order the files by the objects they create and use: the files are grouped
+    into levels, and each level is split into up to 'shards' lanes written as '<output_file>_L<level>_<lane>.sql'.
+    Run the levels one after another and the lanes of a level in parallel.
     
 Features:
     - Traverses specified directories for .sql files.
     - Generates SQLCMD script commands for executing the found .sql files.
+    - Streams the script to a file or stdout line by line, so large trees never build one big string;
+      this also works on headless build agents.
+    - Sets ':setvar Path' to each file's own (sub)directory.
+    - Splits the files into 'shards' scripts balanced by total file size (largest files first, each to the
+      currently smallest shard), written as '<output_file>_1.sql', '<output_file>_2.sql', ... Within a shard
+      the files keep their traversal order.
+    - Plans a dependency-ordered deployment ('dependency_order'): every CREATE statement (also lowercase or
+      split across lines) defines an object, and a file depends on the files defining the objects it refers to.
+      The files are sorted topologically into levels whose files can run concurrently, and every level is split
+      into size-balanced lanes. Files that depend on each other in a cycle are reported and kept together in one
+      lane of a single level, where they run one after another in traversal order.
     - Supports outputting the script to the clipboard.
 
 Note:
-    This script requires the 'pyperclip' module for clipboard functionality. Ensure it is installed
-    via 'pip install pyperclip' before running the script.
+    Copying to the clipboard requires the 'pyperclip' module. Ensure it is installed via
+    'pip install pyperclip' before using that option.
+    Shards run independently, so only shard scripts whose files do not depend on each other, or use 'dependency_order'.
+    Dependencies are found by name, from the names after FROM, JOIN, INTO, UPDATE, EXEC, REFERENCES, ON and similar
+    keywords (comments and string literals are ignored); an unqualified reference matches an object of that name in
+    any schema, so the plan errs on the side of running files later.
 """
 
+import io
 import os
-import pyperclip
+import sys
+import heapq
+from collections import defaultdict
+from sql_file_utils import (iter_create_statements, iter_file_entries, iter_object_references, read_text,
+                            strip_sql_comments)
 
-def generate_sqlcmd_script(directories):
+try:
+    import pyperclip
+except ImportError:
+    pyperclip = None
+
+SCRIPT_HEADER = "SET NOCOUNT ON;\nGO\nPRINT @@SERVERNAME;\nGO\n\n"
+
+def collect_sql_files(directories):
+    """
+    Return (directory, entry) for every .sql file in the directories, in traversal order. All roots are
+    walked together, so a file below overlapping roots (e.g. 'src' and 'src/t') is only listed once,
+    with the first root (in list order) that contains it; that is the root whose walk reached it.
+    """
+    prefixes = [(os.path.join(directory, ''), directory) for directory in directories]
+    sql_files = []
+    for entry in iter_file_entries(directories):
+        root = next((directory for prefix, directory in prefixes if entry.path.startswith(prefix)),
+                    os.path.dirname(entry.path))
+        sql_files.append((root, entry))
+    return sql_files
+
+def write_sqlcmd_script(output, sql_files):
+    """
+    Write an SQLCMD script executing the given (directory, entry) files in order to the open text file
+    'output'. ':setvar Path' is emitted whenever the next file lives in a different directory.
+    """
+    output.write(SCRIPT_HEADER)
+    current_path = None
+    for directory, entry in sql_files:
+        file_directory = os.path.dirname(entry.path)
+        if os.path.normpath(file_directory) == os.path.normpath(directory):
+            path = directory
+        else:
+            path = os.path.join(file_directory, '')
+        if path != current_path:
+            output.write(f":setvar Path \"{path}\"\n\n")
+            current_path = path
+
+        # Label each file with the last folder name of its directory and its path below it
+        last_folder_name = os.path.basename(os.path.normpath(directory))
+        relative_name = os.path.relpath(entry.path, directory).replace(os.sep, '/')
+        label = f"{last_folder_name}/{relative_name}".replace("'", "''")
+        output.write(f"PRINT('Executing {label}')\n")
+        output.write(f":setvar SQLFile \"{entry.name}\"\n")
+        output.write(":r $(Path)$(SQLFile)\nGO\n\n")
+
+def shard_sql_files(sql_files, shards, groups=None):
+    """
+    Split the (directory, entry) files into 'shards' lists balanced by total size: the largest file
+    goes first, each to the shard with the fewest bytes so far. Each shard keeps traversal order.
+    With 'groups' (lists of indexes into sql_files) every group is placed as a whole in one shard.
+    Returns a list of (total_bytes, files) per shard.
+    """
+    if groups is None:
+        groups = [[index] for index in range(len(sql_files))]
+    sizes = [sum(sql_files[index][1].stat().st_size for index in group) for group in groups]
+    heap = [(0, shard) for shard in range(shards)]
+    assigned = [[] for _ in range(shards)]
+    totals = [0] * shards
+    for group in sorted(range(len(groups)), key=lambda group: -sizes[group]):
+        total, shard = heapq.heappop(heap)
+        assigned[shard].extend(groups[group])
+        totals[shard] = total + sizes[group]
+        heapq.heappush(heap, (totals[shard], shard))
+    return [(totals[shard], [sql_files[index] for index in sorted(assigned[shard])]) for shard in range(shards)]
+
+def shard_file_name(output_file, shard):
+    """Name of the script of one shard, e.g. deploy.sql -> deploy_1.sql."""
+    base, extension = os.path.splitext(output_file)
+    return f"{base}_{shard}{extension or '.sql'}"
+
+def find_file_dependencies(sql_files, encodings=('utf-8-sig', 'utf-8', 'latin-1')):
+    """
+    Return, for each of the (directory, entry) files, the set of indexes of the files it depends on:
+    the files that CREATE an object the file refers to. A qualified reference (sales.orders) matches an
+    object with that name or an unqualified object of the same last name, and also refers to its schema;
+    an unqualified reference (orders) matches an object of that name in any schema.
+    """
+    by_name, by_last_name = defaultdict(set), defaultdict(set)
+    references = []
+    for index, (_, entry) in enumerate(sql_files):
+        text, _ = read_text(entry.path, encodings)
+        for _, object_name, _ in iter_create_statements(text):
+            by_name[object_name].add(index)
+            by_last_name[object_name.rsplit('.', 1)[-1]].add(index)
+        references.append(set(iter_object_references(strip_sql_comments(text))))
+
+    dependencies = []
+    for index, names in enumerate(references):
+        depends_on = set()
+        for name in names:
+            if '.' in name:
+                parts = name.split('.')
+                depends_on |= by_name.get(name, set()) | by_name.get(parts[-1], set()) | by_name.get(parts[-2], set())
+            else:
+                depends_on |= by_last_name.get(name, set())
+        depends_on.discard(index)
+        dependencies.append(depends_on)
+    return dependencies
+
+def find_dependency_cycles(dependencies):
+    """
+    Return the strongly connected components of the dependency graph (Tarjan's algorithm, iterative),
+    each as a sorted list of file indexes. A component of more than one file is a dependency cycle.
+    """
+    order, low, on_stack = {}, {}, set()
+    stack, components = [], []
+    for root in range(len(dependencies)):
+        if root in order:
+            continue
+        work = [(root, iter(sorted(dependencies[root])))]
+        order[root] = low[root] = len(order)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            index, others = work[-1]
+            for other in others:
+                if other not in order:
+                    order[other] = low[other] = len(order)
+                    stack.append(other)
+                    on_stack.add(other)
+                    work.append((other, iter(sorted(dependencies[other]))))
+                    break
+                if other in on_stack:
+                    low[index] = min(low[index], order[other])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[index])
+                if low[index] == order[index]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == index:
+                            break
+                    components.append(sorted(component))
+    return components
+
+def plan_execution_levels(sql_files, encodings=('utf-8-sig', 'utf-8', 'latin-1')):
+    """
+    Sort the (directory, entry) files topologically into levels: every file only depends on files of
+    earlier levels, so the files of one level can run concurrently. Returns the levels as lists of
+    groups of file indexes. A group is a single file, or files that depend on each other in a cycle;
+    such a cycle is reported and its files have to run one after another, in traversal order.
+    """
+    dependencies = find_file_dependencies(sql_files, encodings)
+    components = find_dependency_cycles(dependencies)
+    component_of = {}
+    for number, component in enumerate(components):
+        for index in component:
+            component_of[index] = number
+        if len(component) > 1:
+            print(f"Circular dependencies between {len(component)} files, which will run serially in one lane:\n"
+                  + "\n".join(f"    {sql_files[index][1].path}" for index in component), file=sys.stderr)
+
+    # Kahn's algorithm over the graph of components
+    depends_on = [{component_of[other] for index in component for other in dependencies[index]} - {number}
+                  for number, component in enumerate(components)]
+    dependents = defaultdict(list)
+    for number, others in enumerate(depends_on):
+        for other in others:
+            dependents[other].append(number)
+
+    waiting = [len(others) for others in depends_on]
+    level = [number for number, count in enumerate(waiting) if count == 0]
+    levels = []
+    while level:
+        level.sort(key=lambda number: components[number][0])
+        levels.append([components[number] for number in level])
+        next_level = []
+        for number in level:
+            for dependent in dependents[number]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    next_level.append(dependent)
+        level = next_level
+    return levels
+
+def write_level_scripts(sql_files, output_file, lanes, encodings=('utf-8-sig', 'utf-8', 'latin-1')):
+    """
+    Write one script per lane for every dependency level, named '<output_file>_L<level>_<lane>.sql'.
+    Returns the list of levels, each a list of the script files of its lanes.
+    """
+    plan = []
+    for level_number, groups in enumerate(plan_execution_levels(sql_files, encodings), start=1):
+        level = [sql_files[index] for group in groups for index in group]
+        # Renumber the groups to indexes into 'level' so each cycle stays in one lane
+        positions, start = [], 0
+        for group in groups:
+            positions.append(list(range(start, start + len(group))))
+            start += len(group)
+        scripts = []
+        for lane, (total_bytes, files) in enumerate(shard_sql_files(level, min(lanes, len(groups)), positions), start=1):
+            script_file = shard_file_name(output_file, f"L{level_number}_{lane}")
+            with open(script_file, 'w', encoding='utf-8') as output:
+                write_sqlcmd_script(output, files)
+            scripts.append(script_file)
+        plan.append(scripts)
+        print(f"Level {level_number}: {len(level)} files in {len(scripts)} lanes", file=sys.stderr)
+    return plan
+
+def generate_sqlcmd_script(directories, output_file=None, shards=1, copy_to_clipboard=False, dependency_order=False):
     """
     Generates an SQLCMD script to execute .sql files in specified directories and
-    copies the script to the clipboard.
+    writes it to 'output_file', copies it to the clipboard, or prints it to stdout.
 
     Parameters:
     directories (list): A list of directory paths containing .sql files to execute.
+    output_file (str): The script file to write; with shards, the base name of the shard scripts.
+    shards (int): The number of scripts to split the files into, balanced by total file size.
+    copy_to_clipboard (bool): Copy the script to the clipboard instead of printing it (single script only).
+    dependency_order (bool): Write dependency levels of up to 'shards' parallel lanes each (see plan_execution_levels).
     """
-    sqlcmd_script_content = "SET NOCOUNT ON;\nGO\nPRINT @@SERVERNAME;\nGO\n\n"
-    
-    for directory in directories:
-        path_var = f":setvar Path \"{directory}\"\n\n"
-        sqlcmd_script_content += path_var
-
-        for root, _, files in os.walk(directory):
-            for filename in files:
-                if filename.endswith('.sql'):
-                    # Extract the last folder name from the directory path
-                    last_folder_name = os.path.basename(os.path.normpath(directory))
-                    sqlcmd_script_content += f"PRINT('Executing {last_folder_name}/{filename}')\n"
-                    sqlcmd_script_content += f":setvar SQLFile \"{filename}\"\n"
-                    sqlcmd_script_content += ":r $(Path)$(SQLFile)\nGO\n\n"
-
-    # Copy the generated SQLCMD script to the clipboard
-    pyperclip.copy(sqlcmd_script_content)
-    print("SQLCMD script has been copied to the clipboard.")
+    sql_files = collect_sql_files(directories)
+
+    if dependency_order:
+        if not output_file:
+            raise ValueError("A dependency-ordered plan writes one script per level and lane, so 'output_file' must be set.")
+        write_level_scripts(sql_files, output_file, max(shards, 1))
+    elif shards > 1:
+        if not output_file:
+            raise ValueError("Sharding writes one script per shard, so 'output_file' must be set.")
+        for shard, (total_bytes, files) in enumerate(shard_sql_files(sql_files, shards), start=1):
+            shard_file = shard_file_name(output_file, shard)
+            with open(shard_file, 'w', encoding='utf-8') as output:
+                write_sqlcmd_script(output, files)
+            print(f"Shard {shard}: {len(files)} files, {total_bytes:,} bytes written to {shard_file}", file=sys.stderr)
+    elif output_file:
+        with open(output_file, 'w', encoding='utf-8') as output:
+            write_sqlcmd_script(output, sql_files)
+        print(f"SQLCMD script has been written to {output_file}.", file=sys.stderr)
+    elif copy_to_clipboard:
+        if pyperclip is None:
+            raise ValueError("The 'pyperclip' module is required to copy to the clipboard. Install it with 'pip install pyperclip'.")
+        # Copy the generated SQLCMD script to the clipboard
+        output = io.StringIO()
+        write_sqlcmd_script(output, sql_files)
+        pyperclip.copy(output.getvalue())
+        print("SQLCMD script has been copied to the clipboard.")
+    else:
+        write_sqlcmd_script(sys.stdout, sql_files)
 
 if __name__ == "__main__":
     # List of directories containing .sql files
     directories = []
-    generate_sqlcmd_script(directories)
+    output_file = None  # e.g. r'C:\tmp\deploy.sql'; None prints the script (or copies it, see below)
+    shards = 1  # Number of scripts to split the files into for parallel sqlcmd sessions (requires output_file)
+    copy_to_clipboard = True  # Copy the script to the clipboard when no output_file is set
+    dependency_order = False  # Set to True to write dependency levels of 'shards' parallel lanes (requires output_file)
+
+    generate_sqlcmd_script(directories, output_file, shards, copy_to_clipboard, dependency_order)
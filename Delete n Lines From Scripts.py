@@ -1,4 +1,12 @@
-import os
+import re
+import codecs
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from sql_file_utils import (atomic_writer, copy_file_tail, decode_bytes, detect_encoding, encode_text,
+                            find_sql_files, rewrite_files)
+
+# A line ends at '\r\n', '\r' or '\n', the same as reading the file in text mode
+LINE_BREAK = re.compile(rb'\r\n?|\n')
 
 def confirm_action(num_lines, directories):
     """
@@ -28,46 +36,129 @@ Features:
     - Prompts user for confirmation before performing deletions.
     - Attempts to handle files with multiple encodings, specifically 'utf-8' and 'latin-1', to accommodate various file origins.
     - Provides feedback on processing status and encoding issues encountered.
+    - Processes files in parallel ('workers') and replaces each file atomically, so an interrupted run never
+      leaves a truncated file.
+    - Supports a dry run ('dry_run') that reports the files that would change without touching disk.
+    - Streaming mode ('streaming') finds the byte offset after line n and copies the rest of the file into a
+      temporary file (using copy_file_range/sendfile where available), so memory use stays constant no
+      matter how large the file is. The remaining lines keep their original line endings.
 
 Note:
     It is recommended to backup your .sql files before running this script to prevent accidental data loss.
     Ensure you have write permissions for the directories and files you intend to process.
 """
 
-def delete_first_n_lines(directories, num_lines, encodings=('utf-8', 'latin-1')):
+def remove_first_n_lines(file_path, data, num_lines, encodings):
+    """
+    Returns the contents of a file without its first n lines, encoded with the first of the
+    encodings that can decode the file.
+    """
+    content, encoding = decode_bytes(data, encodings, file_path)
+
+    # Skip the first n lines
+    position = 0
+    for _ in range(num_lines):
+        position = content.find('\n', position) + 1
+        if position == 0:
+            position = len(content)
+            break
+
+    return encode_text(content[position:], encoding)
+
+def find_offset_after_lines(file, num_lines, block_size=1024 * 1024):
+    """
+    Returns the byte offset just after the first n lines of an open binary file, reading it in blocks.
+    Only valid for encodings where line breaks are the single bytes '\r' and '\n' (e.g. utf-8, latin-1).
+    """
+    position = 0
+    found = 0
+    while found < num_lines:
+        block = file.read(block_size)
+        if not block:
+            break
+        # Never split a '\r\n' pair across two blocks
+        while block.endswith(b'\r'):
+            extra = file.read(1)
+            if not extra:
+                break
+            block += extra
+            if extra != b'\r':
+                break
+
+        for match in LINE_BREAK.finditer(block):
+            found += 1
+            if found == num_lines:
+                return position + match.end()
+        position += len(block)
+    return position
+
+def stream_first_n_lines(file_path, num_lines, encodings, dry_run=False, block_size=1024 * 1024):
+    """
+    Deletes the first n lines of a file without loading it into memory. The byte offset after line n
+    is found by scanning blocks, and the rest of the file is copied unchanged (original line endings
+    included) into a temporary file that then replaces the original. A UTF-8 BOM is kept when the
+    detected encoding is 'utf-8-sig'. Files in encodings whose line breaks are not single bytes are
+    processed in memory instead. Returns (file_path, status, error) like rewrite_files.
+    """
+    try:
+        encoding = detect_encoding(file_path, encodings)
+        if '\r\n'.encode(encoding) != b'\r\n':
+            return next(rewrite_files([file_path], partial(remove_first_n_lines, num_lines=num_lines, encodings=encodings),
+                                      dry_run=dry_run))
+
+        keep_bom = codecs.lookup(encoding).name == 'utf-8-sig'
+        with open(file_path, 'rb') as source:
+            has_bom = source.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8
+            if not has_bom:
+                source.seek(0)
+            offset = find_offset_after_lines(source, num_lines, block_size) + (len(codecs.BOM_UTF8) if has_bom else 0)
+        if num_lines <= 0 or offset == 0 or (has_bom and keep_bom and offset == len(codecs.BOM_UTF8)):
+            return file_path, 'unchanged', None
+        if dry_run:
+            return file_path, 'would update', None
+
+        # The source is closed before the temporary file replaces it (required on Windows)
+        with atomic_writer(file_path) as target, open(file_path, 'rb') as source:
+            if has_bom and keep_bom:
+                target.write(codecs.BOM_UTF8)
+            copy_file_tail(source, target, offset, block_size)
+        return file_path, 'updated', None
+    except Exception as e:
+        return file_path, 'error', e
+
+def delete_first_n_lines(directories, num_lines, encodings=('utf-8', 'latin-1'), workers=8, dry_run=False, streaming=False):
     """
     Deletes the first n lines from all .sql files in the specified directories,
     trying multiple encodings in case of UnicodeDecodeErrors.
+    Files are processed by 'workers' threads and replaced atomically. With 'dry_run' the files
+    that would change are only reported. With 'streaming' files are never loaded into memory
+    and keep their original line endings (see stream_first_n_lines).
     """
-    if not confirm_action(num_lines, directories):
+    if not dry_run and not confirm_action(num_lines, directories):
         print("Operation canceled.")
         return
-    
-    for directory in directories:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.endswith(".sql"):
-                    file_path = os.path.join(root, file)
-                    for encoding in encodings:
-                        try:
-                            with open(file_path, 'r', encoding=encoding) as f:
-                                lines = f.readlines()
-                            # Skip the first n lines
-                            new_content = lines[num_lines:]
-                            # Write the remaining content back to the file
-                            with open(file_path, 'w', encoding=encoding) as f:
-                                f.writelines(new_content)
-                            print(f"Processed {file_path} with encoding {encoding}")
-                            break  # Stop trying encodings if successful
-                        except UnicodeDecodeError as e:
-                            print(f"Error decoding {file_path} with {encoding}: {e}")
-                            if encoding == encodings[-1]:  # Last encoding option
-                                print(f"Failed to process {file_path} due to encoding issues.")
+
+    if streaming:
+        stream = partial(stream_first_n_lines, num_lines=num_lines, encodings=encodings, dry_run=dry_run)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            results = list(executor.map(stream, find_sql_files(directories)))
+    else:
+        transform = partial(remove_first_n_lines, num_lines=num_lines, encodings=encodings)
+        results = rewrite_files(find_sql_files(directories), transform, workers, dry_run=dry_run)
+
+    for file_path, status, error in results:
+        if status == 'error':
+            print(f"Failed to process {file_path}: {error}")
+        else:
+            print(f"Processed {file_path}: {status}")
 
 if __name__ == "__main__":
     # Directories to process
     directories = []
     num_lines_to_delete = 6  # Adjust the number of lines you want to delete
+    workers = 8  # Number of files processed at the same time
+    dry_run = False  # Set to True to only report which files would change
+    streaming = True  # Stream each file in constant memory, keeping its line endings; False rewrites it in memory
 
-    delete_first_n_lines(directories, num_lines_to_delete)
+    delete_first_n_lines(directories, num_lines_to_delete, workers=workers, dry_run=dry_run, streaming=streaming)
     print("Done processing .sql files.")
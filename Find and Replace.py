@@ -12,6 +12,8 @@ Description:
 Usage:
     - Define the 'search_pattern' with a regular expression that matches the text you wish to replace.
     - Set the 'replacement_string' to the text that will replace each occurrence of the search pattern.
+    - Or set 'rules_file' to a file of many rules, one per line as the search pattern and the replacement
+      separated by a tab (see 'Find and Replace Rules.txt'). The rules are applied in order.
     - List all target directories in the 'directories' list where the SQL files are located.
     - Specify the 'encodings' list with the encodings to try when opening and saving files, accommodating
       different file encoding standards for compatibility.
@@ -20,7 +22,14 @@ Usage:
 Features:
     - Supports multiple encodings for reading and writing files, ensuring wide compatibility with different file formats.
     - Uses regular expressions for pattern matching, providing flexibility in defining the search pattern.
-    - Performs in-place file updates, directly modifying the original files with the new content.
+    - Applies all rules of a rules file in a single read and write per file, with the patterns compiled once.
+    - Skips files quickly: binary files (containing NUL bytes) are never decoded, and a byte-level prefilter
+      skips files that contain none of the rules' literal text. Set 'extensions' to limit the file types.
+    - Performs in-place file updates, directly modifying the original files with the new content. Files are
+      processed in parallel ('workers') and replaced atomically, so an interrupted run never truncates a file.
+    - Optionally uses a token index ('index_file', see TokenIndex in sql_file_utils.py) to only open the files
+      that can contain a match. The index is updated incrementally before the rules are applied.
+    - Supports a dry run ('dry_run') that reports the files that would change without touching disk.
     - Prints a message for each file that is updated, providing a clear log of changes made.
 
 Note:
@@ -29,37 +38,196 @@ Note:
     The script does not modify filenames or directory names, only the contents of the files.
 
 """
-import os
 import re
+import string
+from functools import partial
+from sql_file_utils import TokenIndex, decode_bytes, encode_text, find_files, rewrite_files
 
-def replace_in_file(file_path, search_pattern, replacement, encodings):
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                file_contents = f.read()
-
-            # Replace occurrences
-            new_contents = re.sub(search_pattern, replacement, file_contents)
-
-            # If changes were made, write the file
-            if new_contents != file_contents:
-                with open(file_path, 'w', encoding=encoding) as f:
-                    f.write(new_contents)
-                print(f"Updated {file_path}")
-            # Stop after successfully reading and writing the file
-            break
-        except UnicodeDecodeError:
+# Characters with a special meaning in a regular expression
+REGEX_SPECIAL_CHARACTERS = '.^$*+?{}[]()|\\'
+
+def load_rules(rules_file):
+    """
+    Load search/replace rules from a file with one rule per line: the search pattern and the
+    replacement separated by a tab. Blank lines are ignored.
+    """
+    rules = []
+    with open(rules_file, 'r', encoding='utf-8-sig') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            if '\t' not in line:
+                raise ValueError(f"Rule on line {line_number} of {rules_file} has no tab between pattern and replacement.")
+            search_pattern, replacement = line.split('\t', 1)
+            rules.append((search_pattern, replacement))
+    return rules
+
+def literal_anchor(search_pattern):
+    """
+    Return the longest piece of literal text that every match of the pattern must contain, or None
+    if no such text can be determined. Anything that could make text optional (alternation, groups,
+    character classes, quantifiers, inline flags, escapes such as \\d) ends the literal run, so the
+    result is conservative: a file without the anchor cannot contain a match.
+    """
+    if '|' in search_pattern or '(?' in search_pattern:
+        return None
+
+    runs, current = [], ''
+    position, depth = 0, 0
+    while position < len(search_pattern):
+        char = search_pattern[position]
+        if char == '\\':
+            escaped = search_pattern[position + 1:position + 2]
+            position += 2
+            if depth == 0 and escaped and not escaped.isalnum() and escaped not in '\r\n':
+                current += escaped
+            else:
+                runs.append(current)
+                current = ''
+                # Skip the arguments of escapes such as \x41, \u00e9 or \101, which are not literal text
+                position = skip_escape_arguments(search_pattern, position, escaped)
             continue
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
-            break
+        if char == '[':
+            # Skip the whole character class
+            runs.append(current)
+            current = ''
+            position += 1
+            if search_pattern[position:position + 1] == ']':
+                position += 1
+            while position < len(search_pattern) and search_pattern[position] != ']':
+                position += 2 if search_pattern[position] == '\\' else 1
+        elif char == '(':
+            runs.append(current)
+            current = ''
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif char in '*?':
+            # The previous character becomes optional
+            current = current[:-1]
+            runs.append(current)
+            current = ''
+        elif char == '{':
+            # Treat as a quantifier of the previous character and skip to the closing brace
+            current = current[:-1]
+            runs.append(current)
+            current = ''
+            closing = search_pattern.find('}', position)
+            position = closing if closing != -1 else len(search_pattern)
+        elif char in REGEX_SPECIAL_CHARACTERS or char in '\r\n':
+            runs.append(current)
+            current = ''
+        elif depth == 0:
+            current += char
+        position += 1
+    runs.append(current)
+
+    anchor = max(runs, key=len)
+    return anchor or None
+
+def skip_escape_arguments(search_pattern, position, escaped):
+    """
+    Return the position after the arguments of the escape '\\<escaped>' whose arguments start at
+    'position': the hex digits of \\x, \\u and \\U, the name of \\N{...}, the octal digits of \\0 and
+    \\ooo, and the digits of a group reference such as \\12.
+    """
+    def skip(allowed, limit):
+        end = position
+        while end < len(search_pattern) and end - position < limit and search_pattern[end] in allowed:
+            end += 1
+        return end
+
+    if escaped in 'xuU':
+        return skip(string.hexdigits, {'x': 2, 'u': 4, 'U': 8}[escaped])
+    if escaped == 'N' and search_pattern[position:position + 1] == '{':
+        closing = search_pattern.find('}', position)
+        return closing + 1 if closing != -1 else len(search_pattern)
+    if escaped == '0':
+        return skip(string.octdigits, 2)
+    if escaped.isdigit():
+        if escaped in string.octdigits and skip(string.octdigits, 2) == position + 2:
+            # Three octal digits are an octal escape
+            return position + 2
+        # Otherwise a reference to group 1 - 99
+        return skip(string.digits, 1)
+    return position
+
+def build_prefilter(rules, encodings):
+    """
+    Build one byte-level regular expression that finds any rule's literal anchor in the raw file
+    contents, in each of the given encodings. Returns None when some rule has no anchor, in which
+    case every text file has to be checked.
+    """
+    anchors = set()
+    for search_pattern, _ in rules:
+        anchor = literal_anchor(search_pattern)
+        if anchor is None:
+            return None
+        for encoding in encodings:
+            try:
+                anchors.add(anchor.encode('utf-8' if encoding.lower().replace('_', '-') == 'utf-8-sig' else encoding))
+            except UnicodeEncodeError:
+                continue
+    return re.compile(b'|'.join(re.escape(anchor) for anchor in sorted(anchors, key=len, reverse=True)))
+
+def is_binary(data, sniff_size=8192):
+    """Treat a file as binary when its first bytes contain a NUL byte."""
+    return b'\x00' in data[:sniff_size]
+
+def replace_in_file(file_path, data, rules, encodings, prefilter=None):
+    # Never decode binary files, and skip files that contain none of the rules' literal text
+    if is_binary(data) or (prefilter is not None and not prefilter.search(data)):
+        return None
+
+    # Decode the file with the first encoding that can decode it
+    file_contents, encoding = decode_bytes(data, encodings, file_path)
 
-def replace_in_files(directories, search_pattern, replacement, encodings):
-    for directory in directories:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                file_path = os.path.join(root, file)
-                replace_in_file(file_path, search_pattern, replacement, encodings)
+    # Apply every rule in order to the text in memory
+    new_contents = file_contents
+    for pattern, replacement in rules:
+        new_contents = pattern.sub(replacement, new_contents)
+
+    # Only return new contents if changes were made
+    if new_contents != file_contents:
+        return encode_text(new_contents, encoding)
+    return None
+
+def find_candidate_files(index_file, directories, file_paths, rules, encodings):
+    """
+    Update the token index and return the files that can contain a match of any rule, in their original
+    order. Every file is returned when some rule has no literal text to look up.
+    """
+    anchors = [literal_anchor(search_pattern) for search_pattern, _ in rules]
+    with TokenIndex(index_file) as index:
+        index.update(file_paths, directories, encodings)
+        candidates = None if None in anchors else index.candidate_files_any(anchors)
+    if candidates is None:
+        return file_paths
+    print(f"Token index: {len(candidates)} of {len(file_paths)} files can contain a match")
+    return [file_path for file_path in file_paths if file_path in candidates]
+
+def replace_in_files(directories, rules, encodings, workers=8, dry_run=False, extensions=None, index_file=None):
+    """
+    Apply a list of (search_pattern, replacement) rules to every file in the directories with a single
+    read and at most one write per file. With 'extensions' (e.g. ['.sql']) only matching files are processed.
+    With an 'index_file', files the token index rules out are not opened at all.
+    """
+    compiled_rules = [(re.compile(search_pattern), replacement) for search_pattern, replacement in rules]
+    transform = partial(replace_in_file, rules=compiled_rules, encodings=encodings,
+                        prefilter=build_prefilter(rules, encodings))
+
+    file_paths = find_files(directories, extensions)
+    if index_file:
+        file_paths = find_candidate_files(index_file, directories, list(file_paths), rules, encodings)
+
+    for file_path, status, error in rewrite_files(file_paths, transform, workers, dry_run=dry_run):
+        if status == 'updated':
+            print(f"Updated {file_path}")
+        elif status == 'would update':
+            print(f"Would update {file_path}")
+        elif status == 'error':
+            print(f"Error processing {file_path}: {error}")
 
 if __name__ == "__main__":
     
@@ -68,15 +236,28 @@ if __name__ == "__main__":
     
     # and replace it with this string
     replacement_string = 'bsav2_mytest_db'
+
+    # Or apply many rules at once from a file (pattern<TAB>replacement per line), e.g. 'Find and Replace Rules.txt'
+    rules_file = None
+
+    rules = load_rules(rules_file) if rules_file else [(search_pattern, replacement_string)]
     
     # Ask for confirmation before starting the process
-    confirmation = input(f"Are you sure you want to replace occurrences of '{search_pattern}' with '{replacement_string}' in all specified directories? (Y/N): ").strip().lower()
+    if rules_file:
+        prompt = f"Are you sure you want to apply the {len(rules)} rules in '{rules_file}' in all specified directories? (Y/N): "
+    else:
+        prompt = f"Are you sure you want to replace occurrences of '{search_pattern}' with '{replacement_string}' in all specified directories? (Y/N): "
+    confirmation = input(prompt).strip().lower()
     if confirmation == 'y':
         encodings = ['utf-8-sig', 'utf-8', 'latin-1']
 
         directories = []
-        
-        replace_in_files(directories, search_pattern, replacement_string, encodings)
+        extensions = None  # e.g. ['.sql'] to only process .sql files; None processes every (non-binary) file
+        workers = 8  # Number of files processed at the same time
+        dry_run = False  # Set to True to only report which files would change
+        index_file = None  # e.g. r'C:\temp\token_index.db' to only open files the token index lists as candidates
+
+        replace_in_files(directories, rules, encodings, workers, dry_run, extensions, index_file)
         print("Done processing all directories.")
     else:
         print("Operation cancelled by the user.")
@@ -14,71 +14,183 @@ Features:
     - Recursively searches directories for .sql files.
     - Analyzes files for 'CREATE', 'ALTER', 'INSERT', 'UPDATE' SQL commands.
     - Captures file size, directory path, and file encoding.
-    - Outputs analysis results in CSV format to a specified file.
+    - Outputs analysis results in CSV format to a specified file, one row per file in the order of the directory walk.
+    - Streams each file in fixed-size blocks ('block_size' characters), counting lines and all four commands in a
+      single pass; a command split across two blocks is counted once. Memory use does not depend on file size.
+    - Optionally analyzes files in a process pool ('workers', 'chunk_size'); rows are still written in walk order.
+      The file sizes come from the stat data of the directory walk.
+    - Optionally analyzes files as memory-mapped bytes in fixed-size chunks ('use_mmap') so multi-GB scripts
+      can be analyzed in bounded memory.
+    - Optionally keeps a scan cache ('cache_file') so re-runs only analyze new or modified files.
 
 Note:
-    This script is designed to handle files with different encodings by attempting to open files using a list of common encodings. 
+    This script is designed to handle files with different encodings by reading each file once and decoding it with the first working encoding of a list. 
     Modify the 'encodings' list in the 'analyze_sql_file' function if additional encodings need to be supported.
 """
 
 import os
+import mmap
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from sql_file_utils import KeywordMatcher, ScanCache, detect_encoding, iter_file_entries, make_signature
 
-def find_sql_files(directory, output_file):
+# Bump when the analysis changes so cached results from older versions are discarded
+ANALYZER_VERSION = 1
+
+# SQL commands counted in each file, with the analysis key they are stored under
+SQL_COMMANDS = {'CREATE': 'create_count', 'ALTER': 'alter_count', 'INSERT': 'insert_count', 'UPDATE': 'update_count'}
+
+def analyze_files(file_paths, analyze, workers=1, chunk_size=16):
+    """
+    Yield (analysis, encoding) for every file in the order given. With more than one worker the files
+    are spread across a process pool; results are still yielded in input order.
+    """
+    if workers <= 1:
+        for file_path in file_paths:
+            yield analyze(file_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(analyze, file_paths, chunksize=chunk_size)
+
+def find_sql_files(directory, output_file, cache_file=None, use_mmap=False, workers=1, chunk_size=16, block_size=1024 * 1024):
     """
     This function walks through a directory and its subdirectories,
     writing the results of the analysis, including the file encoding, to an output file with headers.
+    With a 'cache_file', files unchanged since the previous run are not re-analyzed. With 'use_mmap',
+    files are analyzed as memory-mapped bytes in bounded memory. With 'workers' above 1, files are
+    analyzed in a process pool; rows are written in the order of the directory walk either way.
     """
+    cache = ScanCache(cache_file, 'list_files_metadata', make_signature(ANALYZER_VERSION, use_mmap)) if cache_file else None
+    analyze = analyze_sql_file_mmap if use_mmap else partial(analyze_sql_file, block_size=block_size)
     headers = ["File Name", "Size (bytes)", "Directory", "Encoding", "Lines", "CREATEs", "ALTERs", "INSERTs", "UPDATEs"]
-    with open(output_file, 'w', encoding='utf-8') as f:
+
+    entries = list(iter_file_entries([directory]))
+    stats = [entry.stat() for entry in entries]  # Reuses the stat data from the directory listing
+    cached = [cache.get(entry.path, stat) if cache else None for entry, stat in zip(entries, stats)]
+    analyzed = analyze_files([entry.path for entry, result in zip(entries, cached) if result is None],
+                             analyze, workers, chunk_size)
+
+    with open(output_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
         # Write the header row
         f.write(", ".join(headers) + "\n")
-        
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith(".sql"):
-                    file_path = os.path.join(root, file)
-                    file_size = os.path.getsize(file_path)
-                    analysis, encoding_used = analyze_sql_file(file_path)
-                    # Write the data row including the encoding
-                    f.write(f"{file}, {file_size}, {root}, {encoding_used}, {analysis['line_count']}, {analysis['create_count']}, {analysis['alter_count']}, {analysis['insert_count']}, {analysis['update_count']}\n")
-
-def analyze_sql_file(file_path):
+
+        for entry, stat, result in zip(entries, stats, cached):
+            file, file_path = entry.name, entry.path
+            root = os.path.dirname(file_path)
+            if result is not None:
+                analysis, encoding_used = result
+            else:
+                analysis, encoding_used = next(analyzed)
+                if cache and encoding_used:
+                    cache.put(file_path, [analysis, encoding_used], stat)
+            # Write the data row including the encoding
+            f.write(f"{file}, {stat.st_size}, {root}, {encoding_used}, {analysis['line_count']}, {analysis['create_count']}, {analysis['alter_count']}, {analysis['insert_count']}, {analysis['update_count']}\n")
+
+    if cache:
+        print(f"Scan cache: {cache.hits} files unchanged, {cache.misses} files analyzed")
+        cache.close()
+
+def analyze_sql_file(file_path, block_size=1024 * 1024):
     """
     Analyzes the given SQL file for the number of lines, 'CREATE' keywords,
     'ALTER', 'INSERT', and 'UPDATE' statements, and returns the encoding used.
-    Attempts to open files with a robust approach to handle various encodings.
+    The file is decoded with the first encoding in the list that can decode it and streamed in
+    blocks of 'block_size' characters, so memory use does not depend on the file size.
     """
-    counts = {'line_count': 0, 'create_count': 0, 'alter_count': 0, 'insert_count': 0, 'update_count': 0}
     encodings = ['utf-8-sig', 'latin-1']
-    file_content = None
-    encoding_used = ""
 
     for encoding in encodings:
         try:
-            with open(file_path, 'r', encoding=encoding) as file:
-                file_content = file.readlines()
-                encoding_used = encoding  # Capture the encoding successfully used
-                break
+            return count_lines_and_commands(file_path, encoding, block_size), encoding
         except UnicodeDecodeError:
+            # Not valid in this encoding; start over with the next one
             continue
         except Exception as e:
             print(f"Failed to read {file_path} due to an unexpected error: {e}")
-            return counts, encoding_used
+            break
+    else:
+        print(f"Failed to read {file_path}: none of the encodings {encodings} can decode it")
+    return {'line_count': 0, 'create_count': 0, 'alter_count': 0, 'insert_count': 0, 'update_count': 0}, ""
+
+def count_lines_and_commands(file_path, encoding, block_size=1024 * 1024):
+    """
+    Count the lines and SQL commands of a file in one pass over blocks of decoded text. Line endings
+    are translated to '\n' as in text mode. The last few upper-cased characters of each block are
+    carried into the next one, so a command split across two blocks is still counted, and matches lying
+    entirely in the carried part are subtracted because the previous block already counted them.
+    Raises UnicodeDecodeError when the file is not valid in the encoding.
+    """
+    counts = {'line_count': 0, 'create_count': 0, 'alter_count': 0, 'insert_count': 0, 'update_count': 0}
+    overlap = max(len(command) for command in SQL_COMMANDS) - 1
+    line_breaks = 0
+    carry = ''
+    last_char = ''
+
+    with open(file_path, 'r', encoding=encoding) as file:
+        for block in iter(lambda: file.read(block_size), ''):
+            line_breaks += block.count('\n')
+            last_char = block[-1]
+            window = carry + block.upper()
+            for command, key in SQL_COMMANDS.items():
+                counts[key] += window.count(command) - carry.count(command)
+            carry = window[-overlap:]
+
+    if last_char:
+        counts['line_count'] = line_breaks + (0 if last_char == '\n' else 1)
+    return counts
+
+# Keywords counted by the memory-mapped analyzer
+sql_command_matcher = KeywordMatcher(['CREATE', 'ALTER', 'INSERT', 'UPDATE'])
+
+def analyze_sql_file_mmap(file_path, chunk_size=4 * 1024 * 1024):
+    """
+    Memory-mapped variant of analyze_sql_file for very large files. The keywords are counted
+    case-insensitively over the raw bytes and lines are counted by their line breaks ('\n', '\r'
+    or '\r\n'), one chunk at a time, so the file is never decoded or held in memory as a whole.
+    Results match analyze_sql_file for ASCII content.
+    """
+    counts = {'line_count': 0, 'create_count': 0, 'alter_count': 0, 'insert_count': 0, 'update_count': 0}
+    encoding_used = ""
+
+    try:
+        keyword_counts = sql_command_matcher.count_file(file_path, chunk_size)
+        with open(file_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return counts, 'utf-8-sig'
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                encoding_used = detect_encoding(file_path, ['utf-8-sig', 'latin-1'])
+                line_breaks = 0
+                for start in range(0, size, chunk_size):
+                    chunk = buffer[start:start + chunk_size]
+                    line_breaks += chunk.count(b'\n') + chunk.count(b'\r') - chunk.count(b'\r\n')
+                    # A '\r\n' split across two chunks is a single line break
+                    if chunk.endswith(b'\r') and buffer[start + len(chunk):start + len(chunk) + 1] == b'\n':
+                        line_breaks -= 1
+                ends_with_line_break = buffer[size - 1:size] in (b'\n', b'\r')
+    except Exception as e:
+        print(f"Failed to read {file_path} due to an unexpected error: {e}")
+        return counts, encoding_used
 
-    if file_content:
-        for line in file_content:
-            counts['line_count'] += 1
-            upper_line = line.upper()
-            counts['create_count'] += upper_line.count('CREATE')
-            counts['alter_count'] += upper_line.count('ALTER')
-            counts['insert_count'] += upper_line.count('INSERT')
-            counts['update_count'] += upper_line.count('UPDATE')
+    counts['line_count'] = line_breaks + (0 if ends_with_line_break else 1)
+    counts['create_count'] = keyword_counts['CREATE']
+    counts['alter_count'] = keyword_counts['ALTER']
+    counts['insert_count'] = keyword_counts['INSERT']
+    counts['update_count'] = keyword_counts['UPDATE']
 
     return counts, encoding_used
 
-# Set the directory and output file path
-directory = r'c:\temp\\'
-output_file = r"c:\temp\FileAnalysisSQL.txt"
-find_sql_files(directory, output_file)
+if __name__ == "__main__":
+    # Set the directory and output file path
+    directory = r'c:\temp\\'
+    output_file = r"c:\temp\FileAnalysisSQL.txt"
+    cache_file = None  # e.g. r"c:\temp\scan_cache.db" to only re-analyze files that changed since the last run
+    use_mmap = False  # Set to True to analyze very large files as memory-mapped bytes in bounded memory
+    workers = 1  # Number of worker processes; set to os.cpu_count() to use every core
+    chunk_size = 16  # Number of files sent to a worker process at a time
+    block_size = 1024 * 1024  # Number of characters read from a file at a time
+    find_sql_files(directory, output_file, cache_file, use_mmap, workers, chunk_size, block_size)
 
-print(f"Analysis completed. Results are written to {output_file}.")
+    print(f"Analysis completed. Results are written to {output_file}.")
@@ -1,27 +1,148 @@
+"""
+Remove Dates From Filenames
+
+Description:
+    This script removes the '_YYYYMMDD' date suffix from file names, e.g. 'usp_GetOrders_20240115.sql'
+    becomes 'usp_GetOrders.sql'. It plans the renames for whole directory trees first, reports files whose
+    new names would collide, and then renames the files, writing a journal so the renames can be undone.
+
+Usage:
+    - List the directories to process in the 'directories' list. Subdirectories are processed as well.
+    - Run the script with 'dry_run' set to True to print the planned renames without changing anything.
+    - Set 'dry_run' to False to rename the files. A journal file is written to 'journal_dir' before the
+      first file is renamed.
+    - To undo a run, set 'undo_journal' to the path of its journal file and run the script again.
+
+Features:
+    - Walks the directory trees once and plans every rename in a single pass, checking collisions with a
+      hash set of the existing file names (case-insensitive on Windows).
+    - When several dated versions of a file collapse to the same name, only the newest date is renamed;
+      the older versions are left in place and reported.
+    - A file is never renamed onto an existing file; such renames are skipped and reported.
+    - Renames are applied in a thread pool ('workers'), which helps on network shares.
+    - The journal lists each planned rename (old path, new path). Undo renames every file that was moved
+      back to its old name, so it also repairs a run that was interrupted half-way.
+
+Note:
+    Files are only renamed, never deleted or overwritten. Keep the journal until you are sure the renames are correct.
+"""
 import os
 import re
-
-# Replace 'your/directory/path' with the path to the directory you want to search
-directory_path = r'C:\temp\\'
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sql_file_utils import atomic_writer, iter_file_entries
 
 # Regex pattern to match '_YYYYMMDD' before the file extension
 date_pattern = re.compile(r'(_\d{8})(\.\w+)$')
 
-# Loop through the files in the specified directory
-for filename in os.listdir(directory_path):
-    # Check if the file name ends with '_YYYYMMDD'
-    match = date_pattern.search(filename)
-    if match:
-        # Extract the file extension
-        file_extension = match.group(2)
-        # New file name without the last 9 characters but with the original extension
-        new_filename = date_pattern.sub(file_extension, filename)
-        # Full path for the old and new file names
-        old_file_path = os.path.join(directory_path, filename)
-        new_file_path = os.path.join(directory_path, new_filename)
-
-        # Print out what would be changed
-        print(f'Would rename "{filename}" to "{new_filename}"')
-
-        # Uncomment the next line to actually perform the renaming after confirming the changes
-        # os.rename(old_file_path, new_file_path)
+def plan_renames(directories, pattern=date_pattern):
+    """
+    Plan the renames for every dated file under the directories in one pass. Returns a list of
+    (old_path, new_path) and a list of (path, reason) for the files that are left alone.
+    """
+    existing = set()
+    candidates = {}  # New path (normalized) -> [(date, old_path, new_path)]
+    for entry in iter_file_entries(directories, extensions=None):
+        existing.add(os.path.normcase(entry.path))
+        match = pattern.search(entry.name)
+        if match:
+            # Remove the date but keep the original extension
+            new_path = os.path.join(os.path.dirname(entry.path), pattern.sub(match.group(2), entry.name))
+            candidates.setdefault(os.path.normcase(new_path), []).append((match.group(1), entry.path, new_path))
+
+    renames, skipped = [], []
+    for key, versions in candidates.items():
+        if key in existing:
+            skipped.extend((old_path, f'"{os.path.basename(new_path)}" already exists') for _, old_path, new_path in versions)
+            continue
+        # Keep the newest date; ties are broken by path so the plan is the same on every run
+        versions.sort(reverse=True)
+        _, old_path, new_path = versions[0]
+        renames.append((old_path, new_path))
+        skipped.extend((path, f'a newer version is renamed to "{os.path.basename(new_path)}"') for _, path, _ in versions[1:])
+    renames.sort()
+    skipped.sort()
+    return renames, skipped
+
+def write_journal(journal_file, renames):
+    """Write the planned renames to the journal (tab-separated old and new path) and flush it to disk."""
+    with atomic_writer(journal_file, durable=True) as file:
+        lines = []
+        for old_path, new_path in renames:
+            if '\t' in old_path + new_path or '\n' in old_path + new_path:
+                raise ValueError(f"Cannot journal a path containing a tab or line break: {old_path}")
+            lines.append(f"{old_path}\t{new_path}\n")
+        file.write(''.join(lines).encode('utf-8'))
+
+def read_journal(journal_file):
+    """Read the (old_path, new_path) pairs from a journal."""
+    with open(journal_file, 'r', encoding='utf-8', newline='') as file:
+        return [tuple(line.rstrip('\n').split('\t')) for line in file if line.strip()]
+
+def rename_file(source, target):
+    """Rename a file unless the target already exists. Returns (source, target, error)."""
+    try:
+        if os.path.exists(target):
+            raise FileExistsError(f'"{target}" already exists')
+        os.rename(source, target)
+        return source, target, None
+    except Exception as e:
+        return source, target, e
+
+def rename_files(pairs, workers=8):
+    """Rename every (source, target) pair in a thread pool and return the number of failures."""
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for source, target, error in executor.map(lambda pair: rename_file(*pair), pairs):
+            if error is not None:
+                failures += 1
+                print(f'Failed to rename "{source}": {error}')
+    return failures
+
+def remove_dates(directories, journal_dir, workers=8, dry_run=True):
+    """
+    Remove the date suffix from all dated files under the directories. With 'dry_run' the planned
+    renames are only printed. Otherwise a journal is written to 'journal_dir' and the files are renamed.
+    Returns the path of the journal, or None.
+    """
+    renames, skipped = plan_renames(directories)
+    for path, reason in skipped:
+        print(f'Skipping "{path}": {reason}')
+
+    if dry_run:
+        for old_path, new_path in renames:
+            print(f'Would rename "{old_path}" to "{os.path.basename(new_path)}"')
+        print(f"{len(renames)} files would be renamed, {len(skipped)} skipped")
+        return None
+    if not renames:
+        print(f"Nothing to rename, {len(skipped)} files skipped")
+        return None
+
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    journal_file = os.path.join(journal_dir, f"rename_journal_{timestamp}.tsv")
+    write_journal(journal_file, renames)
+
+    failures = rename_files(renames, workers)
+    print(f"{len(renames) - failures} files renamed, {failures} failed, {len(skipped)} skipped")
+    print(f"Journal written to {journal_file}")
+    return journal_file
+
+def undo_renames(journal_file, workers=8):
+    """Rename the files listed in a journal back to their old names, skipping files that were never renamed."""
+    pairs = [(new_path, old_path) for old_path, new_path in read_journal(journal_file)
+             if os.path.exists(new_path) and not os.path.exists(old_path)]
+    failures = rename_files(pairs, workers)
+    print(f"{len(pairs) - failures} files renamed back, {failures} failed")
+
+if __name__ == "__main__":
+    # Replace 'your/directory/path' with the paths of the directories you want to process
+    directories = [r'C:\temp\\']
+    journal_dir = r'C:\temp\\'  # Directory for the journal of each run
+    workers = 8  # Number of renames performed at the same time
+    dry_run = True  # Set to False to actually rename the files after checking the planned changes
+    undo_journal = None  # e.g. r'C:\temp\rename_journal_20240115_120000.tsv' to undo that run instead
+
+    if undo_journal:
+        undo_renames(undo_journal, workers)
+    else:
+        remove_dates(directories, journal_dir, workers, dry_run)
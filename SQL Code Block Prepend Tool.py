@@ -9,7 +9,8 @@ Description:
     file origins.
 
 Usage:
-    - Set the 'database_system' variable to either 'sql_server' or 'postgres' based on the target database system.
+    - Set the 'database_system' variable to 'sql_server', 'postgres' or 'sqlite' based on the target database system.
+      'sqlite' is a local stand-in (see 'sqlite_config') for testing and benchmarking without a database server.
     - Configure connection parameters for both SQL Server and PostgreSQL in the 'sql_server_config' and 'postgres_config' dictionaries, respectively.
     - Specify the target directory in the 'directory' variable. The script will process all .sql files within this directory and its subdirectories.
     - Execute the script. It will establish a connection to the specified database, and for each .sql file found, it will insert its contents into the database.
@@ -21,9 +22,27 @@ Features:
     - Automatic traversal of specified directories and subdirectories for thorough file processing.
     - Detailed error logging provides insights into any issues encountered during file processing.
     - Ensures data integrity by committing transactions upon successful insertion of file contents into the database.
+    - Bulk loads the lines ('use_bulk_load') instead of one INSERT round trip per line: PostgreSQL is fed through
+      COPY ... FROM STDIN from a streaming CSV buffer, SQL Server through pyodbc's fast_executemany in batches of
+      'batch_size' rows. The rows are the same as with per-line INSERTs, which remain available for comparison.
+    - Only the driver of the selected database system (pyodbc or psycopg2) has to be installed.
+    - Loads files in parallel over a pool of 'workers' connections and commits every file on its own. Completed
+      files are recorded in the 'FileTextImportCheckpoint' table (created automatically), so an interrupted import
+      resumes where it stopped instead of starting over; failed files are retried on the next run.
+    - Delta sync ('delta_sync'): the checkpoint table keeps each file's size, modification time and content hash.
+      Unchanged files are skipped, and only the rows of changed or deleted files are replaced or removed, each
+      file in one transaction. Reloading after editing a few scripts costs only those files.
+    - Optional normalized layout ('table_layout' = 'normalized'): one 'FileTextImportFile' row per file holds the
+      file name, directory and encoding, and the compact 'FileTextImportLine' table holds (FileId, LineNumber, myText),
+      so the path strings are no longer repeated on every line. A 'FileTextImport' view presents the original
+      shape so existing queries keep working. The tables and the view are created automatically.
 
 Note:
     Before running the script, ensure that the 'FileTextImport' table exists in your target database with columns for file name, line number, text content, and file directory. Additionally, adjust the connection parameters in the configuration dictionaries to match your database server settings.
+    A 'FileTextImportCheckpoint' table created by an older version of this script lacks the fingerprint or
+    PathHash columns; drop it (and empty 'FileTextImport') before the next run.
+    The normalized layout replaces the 'FileTextImport' table with a view of the same name, so drop the table (and
+    the checkpoint table) before switching layouts.
 
 
 --SQl Server
@@ -38,6 +57,7 @@ CREATE TABLE FileTextImport (
     myText         NVARCHAR(MAX) NULL,
     FileDirectory  NVARCHAR(MAX) NULL
 );
+CREATE INDEX IX_FileTextImport_FileName ON FileTextImport (FileName);  --Speeds up replacing the rows of changed files
 
 --Postgres
 DROP TABLE IF EXISTS public."FileTextImport";
@@ -50,16 +70,67 @@ CREATE TABLE public.filetextimport (
     myText         TEXT,
     FileDirectory  TEXT
 );
+CREATE INDEX ix_filetextimport_filename ON public.filetextimport (FileName);  --Speeds up replacing the rows of changed files
+
+--SQLite (created automatically by the script)
+CREATE TABLE IF NOT EXISTS FileTextImport (
+    ID             INTEGER PRIMARY KEY AUTOINCREMENT,
+    InsertDate     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FileName       TEXT,
+    LineNumber     INTEGER,
+    myText         TEXT,
+    FileDirectory  TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_FileTextImport_FileName ON FileTextImport (FileName);
+
+--Normalized layout (created automatically by the script, shown for SQL Server)
+CREATE TABLE FileTextImportFile (
+    FileId         INTEGER IDENTITY(1,1) PRIMARY KEY,
+    InsertDate     DATETIME DEFAULT GETDATE() NULL,
+    FileName       NVARCHAR(255) NULL,
+    FileDirectory  NVARCHAR(MAX) NULL,
+    Encoding       NVARCHAR(50) NULL
+);
+
+CREATE TABLE FileTextImportLine (
+    FileId         INTEGER NOT NULL,
+    LineNumber     INTEGER NOT NULL,
+    myText         NVARCHAR(MAX) NULL,
+    PRIMARY KEY (FileId, LineNumber)
+);
+
+CREATE VIEW FileTextImport AS
+SELECT ROW_NUMBER() OVER (ORDER BY l.FileId, l.LineNumber) AS ID,
+       f.InsertDate AS InsetDate, f.FileName, l.LineNumber, l.myText, f.FileDirectory
+FROM FileTextImportLine l
+JOIN FileTextImportFile f ON f.FileId = l.FileId;
 
 """
 
 
+import io
 import os
-import pyodbc
-import psycopg2
+import csv
+import time
+import hashlib
+import sqlite3
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from sql_file_utils import file_digest, iter_file_entries
+
+# Only the driver of the selected database system has to be installed
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
 
 # Define target database system
-# Options: 'sql_server' or 'postgres'
+# Options: 'sql_server', 'postgres' or 'sqlite'
 database_system = 'postgres'  # Change this to 'postgres' / 'sql_server' as needed
 
 # Example connection information
@@ -79,44 +150,461 @@ postgres_config = {
     'host': 'localhost'
 }
 
+# SQLite stand-in for local testing and benchmarking
+sqlite_config = {
+    'database': r'C:\tmp\FileTextImport.db'
+}
+
 # Directory to search for .sql files
 directory = r'C:\tmp\\'
 
-def import_sql_files(directory, database_system):
+use_bulk_load = True  # Set to False to insert one line per round trip (the original behaviour)
+batch_size = 10000  # Number of rows sent per executemany batch (SQL Server and SQLite)
+workers = 4  # Number of files loaded at the same time, each over its own connection
+delta_sync = True  # Re-import only new and changed files and remove the rows of deleted files
+table_layout = 'wide'  # 'wide' fills the FileTextImport table; 'normalized' fills FileTextImportFile/FileTextImportLine
+
+COLUMNS = "FileName, LineNumber, myText, FileDirectory"
+
+# Encoding used to read the files, recorded per file in the normalized layout
+FILE_ENCODING = 'utf-8'
+
+SQLITE_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS FileTextImport (
+    ID             INTEGER PRIMARY KEY AUTOINCREMENT,
+    InsertDate     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FileName       TEXT,
+    LineNumber     INTEGER,
+    myText         TEXT,
+    FileDirectory  TEXT
+)
+"""
+SQLITE_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS IX_FileTextImport_FileName ON FileTextImport (FileName)"
+
+# Normalized layout: one row per file, one compact row per line, and a view with the original shape
+CREATE_NORMALIZED_TABLES = {
+    'sql_server': ["""
+IF OBJECT_ID('FileTextImportFile', 'U') IS NULL
+CREATE TABLE FileTextImportFile (
+    FileId         INTEGER IDENTITY(1,1) PRIMARY KEY,
+    InsertDate     DATETIME DEFAULT GETDATE() NULL,
+    FileName       NVARCHAR(255) NULL,
+    FileDirectory  NVARCHAR(MAX) NULL,
+    Encoding       NVARCHAR(50) NULL
+)
+""", """
+IF OBJECT_ID('FileTextImportLine', 'U') IS NULL
+CREATE TABLE FileTextImportLine (
+    FileId         INTEGER NOT NULL,
+    LineNumber     INTEGER NOT NULL,
+    myText         NVARCHAR(MAX) NULL,
+    PRIMARY KEY (FileId, LineNumber)
+)
+""", """
+CREATE OR ALTER VIEW FileTextImport AS
+SELECT ROW_NUMBER() OVER (ORDER BY l.FileId, l.LineNumber) AS ID,
+       f.InsertDate AS InsetDate, f.FileName, l.LineNumber, l.myText, f.FileDirectory
+FROM FileTextImportLine l
+JOIN FileTextImportFile f ON f.FileId = l.FileId
+"""],
+    'postgres': ["""
+CREATE TABLE IF NOT EXISTS FileTextImportFile (
+    FileId         SERIAL PRIMARY KEY,
+    InsertDate     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FileName       VARCHAR(255),
+    FileDirectory  TEXT,
+    Encoding       VARCHAR(50)
+)
+""", """
+CREATE TABLE IF NOT EXISTS FileTextImportLine (
+    FileId         INTEGER NOT NULL,
+    LineNumber     INTEGER NOT NULL,
+    myText         TEXT,
+    PRIMARY KEY (FileId, LineNumber)
+)
+""", """
+CREATE OR REPLACE VIEW FileTextImport AS
+SELECT ROW_NUMBER() OVER (ORDER BY l.FileId, l.LineNumber) AS ID,
+       f.InsertDate, f.FileName, l.LineNumber, l.myText, f.FileDirectory
+FROM FileTextImportLine l
+JOIN FileTextImportFile f ON f.FileId = l.FileId
+"""],
+    'sqlite': ["""
+CREATE TABLE IF NOT EXISTS FileTextImportFile (
+    FileId         INTEGER PRIMARY KEY AUTOINCREMENT,
+    InsertDate     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FileName       TEXT,
+    FileDirectory  TEXT,
+    Encoding       TEXT
+)
+""", """
+CREATE TABLE IF NOT EXISTS FileTextImportLine (
+    FileId         INTEGER NOT NULL,
+    LineNumber     INTEGER NOT NULL,
+    myText         TEXT,
+    PRIMARY KEY (FileId, LineNumber)
+)
+""", """
+CREATE VIEW IF NOT EXISTS FileTextImport AS
+SELECT ROW_NUMBER() OVER (ORDER BY l.FileId, l.LineNumber) AS ID,
+       f.InsertDate, f.FileName, l.LineNumber, l.myText, f.FileDirectory
+FROM FileTextImportLine l
+JOIN FileTextImportFile f ON f.FileId = l.FileId
+"""]
+}
+
+# Files whose rows have been committed, with the fingerprint (size, modification time in nanoseconds and
+# SHA-256 of the contents) of the version that was imported. An interrupted import resumes after the files
+# listed here, and a delta sync compares the fingerprints to find changed files. Rows are keyed on the SHA-256
+# of the path (see path_hash), as SQL Server cannot index paths longer than 450 characters.
+CREATE_CHECKPOINT_TABLE = {
+    'sql_server': """
+IF OBJECT_ID('FileTextImportCheckpoint', 'U') IS NULL
+CREATE TABLE FileTextImportCheckpoint (
+    PathHash       CHAR(64) NOT NULL PRIMARY KEY,
+    FilePath       NVARCHAR(MAX) NOT NULL,
+    LineCount      INTEGER NULL,
+    FileSize       BIGINT NULL,
+    ModifiedTime   BIGINT NULL,
+    ContentHash    CHAR(64) NULL,
+    ImportDate     DATETIME DEFAULT GETDATE() NULL
+)
+""",
+    'postgres': """
+CREATE TABLE IF NOT EXISTS FileTextImportCheckpoint (
+    PathHash       CHAR(64) PRIMARY KEY,
+    FilePath       TEXT NOT NULL,
+    LineCount      INTEGER,
+    FileSize       BIGINT,
+    ModifiedTime   BIGINT,
+    ContentHash    CHAR(64),
+    ImportDate     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+""",
+    'sqlite': """
+CREATE TABLE IF NOT EXISTS FileTextImportCheckpoint (
+    PathHash       CHAR(64) PRIMARY KEY,
+    FilePath       TEXT NOT NULL,
+    LineCount      INTEGER,
+    FileSize       BIGINT,
+    ModifiedTime   BIGINT,
+    ContentHash    CHAR(64),
+    ImportDate     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+}
+
+def connect(database_system):
+    """Open a connection to the configured database of the given system."""
     if database_system == 'sql_server':
+        if pyodbc is None:
+            raise ValueError("The 'pyodbc' module is required for SQL Server. Install it with 'pip install pyodbc'.")
         cnxn_string = f"DRIVER={{SQL Server}};SERVER={sql_server_config['server']};DATABASE={sql_server_config['database']};Trusted_Connection={sql_server_config['trusted_connection']};"
-        cnxn = pyodbc.connect(cnxn_string)
+        return pyodbc.connect(cnxn_string)
     elif database_system == 'postgres':
+        if psycopg2 is None:
+            raise ValueError("The 'psycopg2' module is required for PostgreSQL. Install it with 'pip install psycopg2'.")
         cnxn_string = f"dbname={postgres_config['database']} user={postgres_config['user']} password={postgres_config['password']} host={postgres_config['host']}"
-        cnxn = psycopg2.connect(cnxn_string)
+        return psycopg2.connect(cnxn_string)
+    elif database_system == 'sqlite':
+        # Several worker connections write to the same file, so wait for locks instead of failing
+        cnxn = sqlite3.connect(sqlite_config['database'], timeout=60, check_same_thread=False)
+        cnxn.execute("PRAGMA journal_mode=WAL")
+        return cnxn
     else:
         raise ValueError("Unsupported database system specified.")
-    
+
+def create_tables(cnxn, database_system, table_layout='wide'):
+    """
+    Create the tables of the chosen layout where the script manages them: the normalized tables and
+    view on every system, and the wide table on the SQLite stand-in.
+    """
+    if table_layout == 'normalized':
+        statements = CREATE_NORMALIZED_TABLES[database_system]
+    elif table_layout == 'wide':
+        statements = [SQLITE_CREATE_TABLE, SQLITE_CREATE_INDEX] if database_system == 'sqlite' else []
+    else:
+        raise ValueError("Unsupported table layout specified.")
+
+    cursor = cnxn.cursor()
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+        cnxn.commit()
+    finally:
+        cursor.close()
+
+def read_file_lines(file_path):
+    """Yield (LineNumber, myText) for every line of a file."""
+    with open(file_path, 'r', encoding=FILE_ENCODING, errors='ignore') as f:
+        yield from enumerate(f, start=1)
+
+def read_file_rows(file_path):
+    """Yield a (FileName, LineNumber, myText, FileDirectory) row for every line of a file."""
+    file = os.path.basename(file_path)
+    file_directory = os.path.dirname(file_path)  # Get the directory of the file
+    for line_number, line in read_file_lines(file_path):
+        yield file, line_number, line, file_directory
+
+def path_hash(file_path):
+    """The SHA-256 hex digest of a file path, the key of its checkpoint row."""
+    return hashlib.sha256(file_path.encode('utf-8', 'surrogateescape')).hexdigest()
+
+def placeholder(database_system):
+    """The query parameter marker of the database driver."""
+    return '%s' if database_system == 'postgres' else '?'
+
+class CsvRowStream:
+    """
+    A read-only file object producing rows as CSV text on demand, so COPY ... FROM STDIN can be fed
+    without holding more than one buffer of rows in memory.
+    """
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        self.pending = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            batch = list(islice(self.rows, 1000))
+            if not batch:
+                break
+            self.writer.writerows(batch)
+            self.pending += self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+def insert_rows(cnxn, database_system, rows, use_bulk_load=True, batch_size=10000, table='FileTextImport', columns=COLUMNS):
+    """
+    Insert the rows into the table (FileTextImport by default). With 'use_bulk_load' PostgreSQL uses
+    COPY ... FROM STDIN and SQL Server and SQLite use executemany in batches of 'batch_size' rows (with
+    fast_executemany on SQL Server); otherwise every row is inserted with its own statement.
+    COPY reads an unquoted empty CSV field as NULL, so FORCE_NOT_NULL keeps an empty field (an empty line
+    or directory) an empty string, as INSERT stores it. The rows never hold None.
+    """
+    markers = ', '.join([placeholder(database_system)] * len(columns.split(',')))
+    insert_stmt = f"INSERT INTO {table} ({columns}) VALUES ({markers})"
+    cursor = cnxn.cursor()
+    try:
+        if not use_bulk_load:
+            for row in rows:
+                cursor.execute(insert_stmt, row)
+        elif database_system == 'postgres':
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({columns}))",
+                               CsvRowStream(rows), size=1024 * 1024)
+        else:
+            if database_system == 'sql_server':
+                cursor.fast_executemany = True
+            rows = iter(rows)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                cursor.executemany(insert_stmt, batch)
+    finally:
+        cursor.close()
+
+def load_checkpoints(cnxn, database_system):
+    """
+    Create the checkpoint table if needed and return the files already imported, mapped to the
+    (FileSize, ModifiedTime, ContentHash) fingerprint of the imported version.
+    """
     cursor = cnxn.cursor()
-    
-    # Walk through the directory
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".sql"):
-                file_path = os.path.join(root, file)
-                file_directory = os.path.dirname(file_path)  # Get the directory of the file
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        line_number = 1  # Initialize line number
-                        for line in f:
-                            if database_system == 'sql_server':
-                                insert_stmt = "INSERT INTO FileTextImport (FileName, LineNumber, myText, FileDirectory) VALUES (?, ?, ?, ?)"
-                            elif database_system == 'postgres':
-                                insert_stmt = "INSERT INTO FileTextImport (FileName, LineNumber, myText, FileDirectory) VALUES (%s, %s, %s, %s)"
-                            # Execute insert statement
-                            cursor.execute(insert_stmt, (file, line_number, line, file_directory))
-                            line_number += 1
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
-    # Commit transactions and close connection
-    cnxn.commit()
-    cursor.close()
-    cnxn.close()
-
-import_sql_files(directory, database_system)
-print('Task Completed')
+    try:
+        cursor.execute(CREATE_CHECKPOINT_TABLE[database_system])
+        cnxn.commit()
+        cursor.execute("SELECT FilePath, FileSize, ModifiedTime, ContentHash FROM FileTextImportCheckpoint")
+        return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def insert_file(cnxn, database_system, file_path, rows, use_bulk_load=True, batch_size=10000, table_layout='wide'):
+    """
+    Insert the lines of a file in the chosen layout: wide rows into FileTextImport, or one row into
+    FileTextImportFile followed by the compact (FileId, LineNumber, myText) rows in FileTextImportLine.
+    """
+    if table_layout == 'wide':
+        insert_rows(cnxn, database_system, rows, use_bulk_load, batch_size)
+        return
+
+    marker = placeholder(database_system)
+    values = (os.path.basename(file_path), os.path.dirname(file_path), FILE_ENCODING)
+    cursor = cnxn.cursor()
+    try:
+        if database_system == 'sql_server':
+            cursor.execute("INSERT INTO FileTextImportFile (FileName, FileDirectory, Encoding) OUTPUT INSERTED.FileId "
+                           "VALUES (?, ?, ?)", values)
+            file_id = cursor.fetchone()[0]
+        elif database_system == 'postgres':
+            cursor.execute("INSERT INTO FileTextImportFile (FileName, FileDirectory, Encoding) VALUES (%s, %s, %s) "
+                           "RETURNING FileId", values)
+            file_id = cursor.fetchone()[0]
+        else:
+            cursor.execute(f"INSERT INTO FileTextImportFile (FileName, FileDirectory, Encoding) VALUES ({marker}, {marker}, {marker})",
+                           values)
+            file_id = cursor.lastrowid
+    finally:
+        cursor.close()
+
+    line_rows = ((file_id, line_number, line) for _, line_number, line, _ in rows)
+    insert_rows(cnxn, database_system, line_rows, use_bulk_load, batch_size, 'FileTextImportLine', "FileId, LineNumber, myText")
+
+def delete_file_rows(cursor, database_system, file_path, table_layout='wide'):
+    """Delete the imported rows and the checkpoint of a file (within the caller's transaction)."""
+    marker = placeholder(database_system)
+    names = (os.path.basename(file_path), os.path.dirname(file_path))
+    if table_layout == 'normalized':
+        cursor.execute("DELETE FROM FileTextImportLine WHERE FileId IN (SELECT FileId FROM FileTextImportFile "
+                       f"WHERE FileName = {marker} AND FileDirectory = {marker})", names)
+        cursor.execute(f"DELETE FROM FileTextImportFile WHERE FileName = {marker} AND FileDirectory = {marker}", names)
+    else:
+        cursor.execute(f"DELETE FROM FileTextImport WHERE FileName = {marker} AND FileDirectory = {marker}", names)
+    cursor.execute(f"DELETE FROM FileTextImportCheckpoint WHERE PathHash = {marker}", (path_hash(file_path),))
+
+def import_file(cnxn, database_system, file_path, stat, checkpoint=None, use_bulk_load=True, batch_size=10000,
+                table_layout='wide'):
+    """
+    Load one file and record it with its fingerprint in the checkpoint table in a single transaction,
+    so a file is either fully imported and checkpointed or not imported at all. If the file was
+    imported before ('checkpoint'), its old rows are replaced in the same transaction, unless only its
+    modification time changed, in which case just the checkpoint is updated.
+    Returns (file_path, status, line_count, error).
+    """
+    line_count = 0
+
+    def counted(rows):
+        nonlocal line_count
+        for row in rows:
+            line_count += 1
+            yield row
+
+    marker = placeholder(database_system)
+    try:
+        content_hash = file_digest(file_path)
+        cursor = cnxn.cursor()
+        try:
+            if checkpoint is not None and checkpoint[2] == content_hash:
+                cursor.execute(f"UPDATE FileTextImportCheckpoint SET FileSize = {marker}, ModifiedTime = {marker} "
+                               f"WHERE PathHash = {marker}", (stat.st_size, stat.st_mtime_ns, path_hash(file_path)))
+                cnxn.commit()
+                return file_path, 'unchanged', 0, None
+            if checkpoint is not None:
+                delete_file_rows(cursor, database_system, file_path, table_layout)
+
+            insert_file(cnxn, database_system, file_path, counted(read_file_rows(file_path)), use_bulk_load, batch_size,
+                        table_layout)
+            cursor.execute("INSERT INTO FileTextImportCheckpoint (PathHash, FilePath, LineCount, FileSize, ModifiedTime, "
+                           f"ContentHash) VALUES ({', '.join([marker] * 6)})",
+                           (path_hash(file_path), file_path, line_count, stat.st_size, stat.st_mtime_ns, content_hash))
+        finally:
+            cursor.close()
+        cnxn.commit()
+        return file_path, 'updated' if checkpoint is not None else 'imported', line_count, None
+    except Exception as e:
+        cnxn.rollback()
+        return file_path, 'error', 0, e
+
+def remove_file(cnxn, database_system, file_path, table_layout='wide'):
+    """Remove the rows and the checkpoint of a file that no longer exists, in a single transaction."""
+    try:
+        cursor = cnxn.cursor()
+        try:
+            delete_file_rows(cursor, database_system, file_path, table_layout)
+        finally:
+            cursor.close()
+        cnxn.commit()
+        return file_path, 'deleted', 0, None
+    except Exception as e:
+        cnxn.rollback()
+        return file_path, 'error', 0, e
+
+def import_sql_files(directory, database_system, use_bulk_load=True, batch_size=10000, workers=4, delta_sync=True,
+                     table_layout='wide'):
+    """
+    Import every .sql file in the directory, spreading the files over 'workers' threads that each
+    hold their own connection. Every file is committed on its own together with its checkpoint
+    row; files checkpointed by an earlier (possibly interrupted) run are skipped.
+    With 'delta_sync' a checkpointed file is only skipped while its size and modification time are
+    unchanged; otherwise its content hash is compared and, if different, its rows are replaced.
+    Rows of files that were deleted from the directory are removed. To load everything again,
+    empty FileTextImport and FileTextImportCheckpoint first.
+    With 'table_layout' = 'normalized' the lines are stored in FileTextImportFile/FileTextImportLine
+    behind a FileTextImport view instead of in the wide FileTextImport table.
+    """
+    start = time.perf_counter()
+    cnxn = connect(database_system)
+    try:
+        create_tables(cnxn, database_system, table_layout)
+        checkpoints = load_checkpoints(cnxn, database_system)
+    finally:
+        cnxn.close()
+
+    entries = list(iter_file_entries([directory]))
+    pending, skipped = [], 0
+    for entry in entries:
+        stat = entry.stat()
+        checkpoint = checkpoints.get(entry.path)
+        if checkpoint is not None and (not delta_sync or checkpoint[:2] == (stat.st_size, stat.st_mtime_ns)):
+            skipped += 1
+        else:
+            pending.append((entry.path, stat, checkpoint))
+
+    removed = []
+    if delta_sync:
+        prefix = os.path.join(directory, '')
+        existing = {entry.path for entry in entries}
+        removed = [file_path for file_path in checkpoints if file_path.startswith(prefix) and file_path not in existing]
+
+    if skipped:
+        print(f"Skipping {skipped} files already imported")
+
+    # One connection per worker thread, opened on first use
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def worker_connection():
+        if not hasattr(local, 'cnxn'):
+            local.cnxn = connect(database_system)
+            with lock:
+                connections.append(local.cnxn)
+        return local.cnxn
+
+    def import_in_worker(job):
+        file_path, stat, checkpoint = job
+        return import_file(worker_connection(), database_system, file_path, stat, checkpoint, use_bulk_load, batch_size,
+                           table_layout)
+
+    def remove_in_worker(file_path):
+        return remove_file(worker_connection(), database_system, file_path, table_layout)
+
+    counts = {'imported': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'error': 0}
+    line_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            results = list(executor.map(import_in_worker, pending)) + list(executor.map(remove_in_worker, removed))
+        for file_path, status, lines, error in results:
+            counts[status] += 1
+            line_count += lines
+            if error:
+                print(f"Error importing {file_path}: {error}")
+    finally:
+        for worker_cnxn in connections:
+            worker_cnxn.close()
+
+    print(f"Imported {line_count} lines in {time.perf_counter() - start:.1f}s: {counts['imported']} new files, "
+          f"{counts['updated']} changed files, {counts['deleted']} deleted files, "
+          f"{skipped + counts['unchanged']} unchanged files"
+          + (f"; {counts['error']} files failed and will be retried on the next run" if counts['error'] else ""))
+
+if __name__ == "__main__":
+    import_sql_files(directory, database_system, use_bulk_load, batch_size, workers, delta_sync, table_layout)
+    print('Task Completed')
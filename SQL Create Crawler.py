@@ -19,10 +19,21 @@ Usage:
 
 Features:
     - Searches for .sql files in specified directories and their subdirectories.
-    - Supports multiple file encodings, attempting to read each file with each encoding in the list until successful.
+    - Supports multiple file encodings, reading each file once and using the first encoding in the list that can decode it.
     - Identifies CREATE statements for a predefined set of SQL object types and extracts the relevant object names.
+      A single compiled, case-insensitive pattern scans whole statements, so lowercase CREATEs and statements
+      split across lines are found too. Statements in comments are ignored (a '/*' or '--' inside a string
+      does not hide the code after it); statements inside string literals (dynamic SQL) are reported.
     - Outputs a comprehensive list of the found objects, including their type, name, and the file they were found in,
-      to a timestamped file for easy reference and analysis.
+      to a timestamped file for easy reference and analysis. Results are written as each file is scanned, so
+      memory use stays flat however large the corpus is.
+    - Includes a benchmark ('run_benchmark') comparing the scanner with the original line-by-line loop.
+    - Optionally maintains a persistent object catalog ('catalog_file', a SQLite database) of every object's type,
+      schema-qualified name, defining file and line, along with each file's fingerprint (size, modification time
+      and SHA-256). Each run only re-scans new or changed files and drops deleted ones. Indexed lookups answer
+      "which script creates dbo.usps_zipcodes?" ('lookup_names') or list all names with a prefix in milliseconds,
+      and objects defined in more than one file (or with conflicting types) are reported from the catalog.
+    - Optionally keeps a scan cache ('cache_file') so re-runs only scan new or modified files.
 
 Note:
     The script assumes that the CREATE 
@@ -30,63 +41,256 @@ Note:
 
 import os
 import re
+import time
+import sqlite3
+import hashlib
 import datetime
+from sql_file_utils import (ScanCache, decode_bytes, find_sql_files, iter_create_statements, make_signature,
+                            read_text)
 
-def find_sql_files_in_directories(directories):
-    """Find all SQL files in the given directories."""
-    sql_files = []
-    for directory in directories:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.sql'):
-                    sql_files.append(os.path.join(root, file))
-    return sql_files
-
-def try_open_file_with_encodings(file_path, encodings):
-    """Attempt to open a file with different encodings until successful."""
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as file:
-                return file.readlines(), encoding
-        except UnicodeDecodeError:
-            continue
-    raise ValueError(f"Failed to open file {file_path} with any of the specified encodings.")
-
-def find_create_statements(sql_file_paths, output_dir, encodings):
-    """Generate object ID checks for CREATE statements in SQL files, handling different encodings."""
+# Bump when the extraction logic changes so cached results from older versions are discarded
+ANALYZER_VERSION = 2
+
+def scan_create_statements(text, filename_no_ext):
+    """Return the object ID check lines ('type,name,file') for every CREATE statement in the text."""
+    return [f"{object_type},{object_name},{filename_no_ext}\n"
+            for object_type, object_name, _ in iter_create_statements(text)]
+
+def find_create_statements(sql_file_paths, output_dir, encodings, cache_file=None):
+    """
+    Generate object ID checks for CREATE statements in SQL files, handling different encodings.
+    The checks of each file are written to the output file as soon as the file is scanned.
+    With a 'cache_file', the checks of files unchanged since the previous run are read from the scan cache.
+    """
+    cache = ScanCache(cache_file, 'sql_create_crawler', make_signature(ANALYZER_VERSION, encodings)) if cache_file else None
+
+    # Output file
+    output_file_path = os.path.join(output_dir, f"object_id_checks_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(output_file_path, 'w', encoding='utf-8') as output_file:
+        for sql_file_path in sql_file_paths:
+            cached = cache.get(sql_file_path) if cache else None
+            if cached is not None:
+                output_file.writelines(cached)
+                continue
+
+            stat = os.stat(sql_file_path) if cache else None
+            used_encoding = None
+            try:
+                text, used_encoding = read_text(sql_file_path, encodings)
+                filename_no_ext = os.path.splitext(os.path.basename(sql_file_path))[0]
+                file_checks = scan_create_statements(text, filename_no_ext)
+
+                if cache:
+                    cache.put(sql_file_path, file_checks, stat)
+                output_file.writelines(file_checks)
+            except Exception as e:
+                print(f"Error processing {sql_file_path} with encoding {used_encoding}: {e}")
+
+    if cache:
+        print(f"Scan cache: {cache.hits} files unchanged, {cache.misses} files scanned")
+        cache.close()
+
+    print(f"Output written to {output_file_path}")
+
+class ObjectCatalog:
+    """
+    Persistent catalog of the objects created by the SQL files, stored in a SQLite database.
+
+    Usage:
+        with ObjectCatalog(catalog_file) as catalog:
+            catalog.update(find_sql_files(directories), directories, encodings)
+            catalog.find('dbo.usps_zipcodes')
+
+    Object names are normalized (lower-case, without brackets). A name without a schema matches the
+    object in any schema. The catalog is rebuilt automatically when ANALYZER_VERSION changes.
+    """
+
+    def __init__(self, catalog_file):
+        self.conn = sqlite3.connect(catalog_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS catalog_info (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                 path     TEXT PRIMARY KEY,
+                                 size     INTEGER NOT NULL,
+                                 mtime_ns INTEGER NOT NULL,
+                                 digest   TEXT NOT NULL,
+                                 encoding TEXT)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS objects (
+                                 object_type TEXT NOT NULL,
+                                 object_name TEXT NOT NULL,
+                                 short_name  TEXT NOT NULL,
+                                 path        TEXT NOT NULL,
+                                 line_number INTEGER NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS objects_by_name ON objects (object_name)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS objects_by_short_name ON objects (short_name)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS objects_by_path ON objects (path)")
+
+        # Rebuild the catalog when the extraction logic changed
+        row = self.conn.execute("SELECT value FROM catalog_info WHERE name = 'version'").fetchone()
+        if row is None or row[0] != str(ANALYZER_VERSION):
+            self.conn.execute("DELETE FROM objects")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("INSERT OR REPLACE INTO catalog_info (name, value) VALUES ('version', ?)", (str(ANALYZER_VERSION),))
+            self.conn.commit()
+
+    def update(self, sql_file_paths, directories, encodings, commit_every=1000):
+        """
+        Bring the catalog up to date: scan new and changed files (a changed modification time with
+        the same content only refreshes the fingerprint) and remove files below 'directories' that no
+        longer exist. Returns a dict with the number of files scanned, unchanged and removed.
+        """
+        known = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest
+                 in self.conn.execute("SELECT path, size, mtime_ns, digest FROM files")}
+        counts = {'scanned': 0, 'unchanged': 0, 'removed': 0}
+        seen = set()
+        pending = 0
+        for sql_file_path in sql_file_paths:
+            seen.add(sql_file_path)
+            stat = os.stat(sql_file_path)
+            fingerprint = known.get(sql_file_path)
+            if fingerprint is not None and fingerprint[:2] == (stat.st_size, stat.st_mtime_ns):
+                counts['unchanged'] += 1
+                continue
+            try:
+                with open(sql_file_path, 'rb') as file:
+                    data = file.read()
+                digest = hashlib.sha256(data).hexdigest()
+                if fingerprint is not None and fingerprint[2] == digest:
+                    self.conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                                      (stat.st_size, stat.st_mtime_ns, sql_file_path))
+                    counts['unchanged'] += 1
+                else:
+                    text, encoding = decode_bytes(data, encodings, sql_file_path)
+                    self._replace_file(sql_file_path, stat, digest, encoding, iter_create_statements(text))
+                    counts['scanned'] += 1
+            except Exception as e:
+                print(f"Error cataloging {sql_file_path}: {e}")
+                continue
+            pending += 1
+            if pending >= commit_every:
+                self.conn.commit()
+                pending = 0
+
+        prefixes = tuple(os.path.join(directory, '') for directory in directories)
+        for path in known:
+            if path not in seen and path.startswith(prefixes):
+                self.conn.execute("DELETE FROM objects WHERE path = ?", (path,))
+                self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                counts['removed'] += 1
+        self.conn.commit()
+        return counts
+
+    def _replace_file(self, path, stat, digest, encoding, statements):
+        """Replace the catalog entries of one file."""
+        self.conn.execute("DELETE FROM objects WHERE path = ?", (path,))
+        self.conn.executemany("INSERT INTO objects (object_type, object_name, short_name, path, line_number) VALUES (?, ?, ?, ?, ?)",
+                              ((object_type, object_name, object_name.rsplit('.', 1)[-1], path, line_number)
+                               for object_type, object_name, line_number in statements))
+        self.conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, encoding) VALUES (?, ?, ?, ?, ?)",
+                          (path, stat.st_size, stat.st_mtime_ns, digest, encoding))
+
+    def find(self, name):
+        """Return (object_type, object_name, path, line_number) of every definition of an object."""
+        name = name.lower().replace('[', '').replace(']', '')
+        column = 'object_name' if '.' in name else 'short_name'
+        return self.conn.execute(f"SELECT object_type, object_name, path, line_number FROM objects WHERE {column} = ? "
+                                 "ORDER BY object_name, path, line_number", (name,)).fetchall()
+
+    def find_prefix(self, prefix, limit=100):
+        """Return up to 'limit' definitions whose name (or unqualified name) starts with the prefix."""
+        prefix = prefix.lower().replace('[', '').replace(']', '')
+        column = 'object_name' if '.' in prefix else 'short_name'
+        # A range condition uses the index, unlike LIKE with the default case-insensitive collation
+        return self.conn.execute(f"SELECT object_type, object_name, path, line_number FROM objects "
+                                 f"WHERE {column} >= ? AND {column} < ? ORDER BY {column}, path LIMIT ?",
+                                 (prefix, prefix + '\uffff', limit)).fetchall()
+
+    def duplicates(self):
+        """
+        Return (object_name, object_types, paths) for every object defined in more than one file or
+        with more than one object type. Indexes are left out, as their names are only unique per table.
+        """
+        definitions = {}
+        for object_name, object_type, path in self.conn.execute("""SELECT DISTINCT object_name, object_type, path
+                                                                   FROM objects
+                                                                   WHERE object_type <> 'index'
+                                                                   ORDER BY object_name, object_type, path"""):
+            object_types, paths = definitions.setdefault(object_name, ([], []))
+            if object_type not in object_types:
+                object_types.append(object_type)
+            if path not in paths:
+                paths.append(path)
+        return [(object_name, object_types, sorted(paths)) for object_name, (object_types, paths) in definitions.items()
+                if len(paths) > 1 or len(object_types) > 1]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def update_catalog(catalog_file, directories, encodings, lookup_names=()):
+    """Update the object catalog, report duplicate definitions and look up the given object names."""
+    with ObjectCatalog(catalog_file) as catalog:
+        start = time.perf_counter()
+        counts = catalog.update(find_sql_files(directories), directories, encodings)
+        print(f"Catalog updated in {time.perf_counter() - start:.1f}s: {counts['scanned']} files scanned, "
+              f"{counts['unchanged']} unchanged, {counts['removed']} removed")
+
+        for object_name, object_types, paths in catalog.duplicates():
+            print(f"Duplicate definition of {object_name} ({', '.join(object_types)}) in: {', '.join(paths)}")
+
+        for name in lookup_names:
+            start = time.perf_counter()
+            definitions = catalog.find(name)
+            elapsed = (time.perf_counter() - start) * 1000
+            if not definitions:
+                print(f"{name}: not found ({elapsed:.1f} ms)")
+            for object_type, object_name, path, line_number in definitions:
+                print(f"{name}: {object_type} {object_name} in {path}, line {line_number} ({elapsed:.1f} ms)")
+
+def scan_create_statements_line_loop(text, filename_no_ext):
+    """The original line-by-line extraction, kept for benchmarking."""
     create_types = [
         "CREATE TYPE", "CREATE TABLE", "CREATE VIEW", "CREATE FUNCTION",
         "CREATE SYNONYM", "CREATE PROCEDURE", "CREATE SEQUENCE",
         "CREATE TRIGGER", "CREATE CONSTRAINT", "CREATE CLUSTERED INDEX",
         "CREATE INDEX", "CREATE NONCLUSTERED INDEX", "CREATE UNIQUE CLUSTERED",
-        "CREATE UNIQUE NONCLUSTERED", "CREATE CLUSTERED INDEX"
+        "CREATE UNIQUE NONCLUSTERED"
     ]
+    file_checks = []
+    for line in text.split('\n'):
+        if any(create_type in line for create_type in create_types):
+            match = re.search(r'\[(.*?)\](?:\.\[(.*?)\])?', line)
+            if match:
+                full_object_name = '.'.join(filter(None, match.groups())).lower()
+                object_type = line.strip().split()[1].lower()
+                file_checks.append(f"{object_type},{full_object_name},{filename_no_ext}\n")
+    return file_checks
 
-    object_id_checks = []
-
+def benchmark_scanners(sql_file_paths, encodings, repeat=3):
+    """Time the statement-level scanner against the original line loop and compare how many objects each finds."""
+    files = []
     for sql_file_path in sql_file_paths:
-        try:
-            lines, used_encoding = try_open_file_with_encodings(sql_file_path, encodings)
-
-            for line in lines:
-                if any(create_type in line for create_type in create_types):
-                    match = re.search(r'\[(.*?)\](?:\.\[(.*?)\])?', line)
-                    if match:
-                        full_object_name = '.'.join(filter(None, match.groups())).lower()
-                        object_type = line.strip().split()[1].lower()
-                        filename_no_ext = os.path.splitext(os.path.basename(sql_file_path))[0]
+        text, _ = read_text(sql_file_path, encodings)
+        files.append((text, os.path.splitext(os.path.basename(sql_file_path))[0]))
+    total_size = sum(len(text) for text, _ in files)
 
-                        object_id_check = f"{object_type},{full_object_name},{filename_no_ext}\n"
-                        object_id_checks.append(object_id_check)
+    results = {}
+    for name, scan in (("Line loop", scan_create_statements_line_loop), ("Statement scanner", scan_create_statements)):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = sum(len(scan(text, filename_no_ext)) for text, filename_no_ext in files)
+            times.append(time.perf_counter() - start)
+        results[name] = (min(times), found)
 
-        except Exception as e:
-            print(f"Error processing {sql_file_path} with encoding {used_encoding}: {e}")
-
-    # Output file
-    output_file_path = os.path.join(output_dir, f"object_id_checks_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-    with open(output_file_path, 'w', encoding='utf-8') as output_file:
-        output_file.writelines(object_id_checks)
-    print(f"Output written to {output_file_path}")
+    print(f"Benchmarked {len(files)} files ({total_size:,} characters), best of {repeat}")
+    for name, (best, found) in results.items():
+        print(f"    {name + ':':<19} {best:.3f}s, {found} objects found")
 
 encodings = ['utf-8-sig', 'utf-8', 'latin-1']
 directories = [
@@ -95,9 +299,20 @@ directories = [
 ]
 
 output_dir =  r'C:\temp\\' 
+cache_file = None  # e.g. r'C:\temp\scan_cache.db' to only re-scan files that changed since the last run
+run_benchmark = False  # Set to True to compare the statement scanner with the original line loop instead of writing output
+catalog_file = None  # e.g. r'C:\temp\object_catalog.db' to keep a persistent catalog of which file defines which object
+lookup_names = []  # Object names to look up in the catalog, e.g. ['dbo.usps_zipcodes']
+
+if __name__ == "__main__":
+    # Find SQL files in directories
+    sql_file_paths = find_sql_files(directories)
 
-# Find SQL files in directories
-sql_file_paths = find_sql_files_in_directories(directories)
+    if run_benchmark:
+        benchmark_scanners(list(sql_file_paths), encodings)
+    else:
+        # Generate object ID checks
+        find_create_statements(sql_file_paths, output_dir, encodings, cache_file)
 
-# Generate object ID checks
-find_create_statements(sql_file_paths, output_dir, encodings)
+        if catalog_file:
+            update_catalog(catalog_file, directories, encodings, lookup_names)
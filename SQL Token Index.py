@@ -0,0 +1,88 @@
+"""
+SQL Token Index Tool
+
+Description:
+    This script maintains an on-disk inverted index of the tokens (identifiers, keywords, @variables and
+    #temp tables) in all .sql files within the specified directories, and answers questions from the index
+    without reading the files again. It is meant to be run before a 'Find and Replace.py' job or a
+    'SQL Sleuth.py' keyword audit, to see where a token occurs and how often.
+
+Usage:
+    - Set 'index_file' to the path of the index database. It is created on the first run.
+    - List the directories containing your .sql files in the 'directories' list.
+    - Add the keywords to count to 'count_keywords'.
+    - To preview a replacement, set 'preview_search' to the text to replace and 'preview_replacement' to
+      its replacement.
+    - Run the script. The index is brought up to date first, then the counts and the preview are printed.
+
+Features:
+    - Only new and modified files are tokenized on later runs; deleted files are removed from the index.
+      Files can be tokenized in a process pool ('workers').
+    - Keyword counts are case-insensitive and match a text search for keywords made of identifier
+      characters (e.g. 'NOLOCK', 'sp_', '@BankId'). Other keywords are reported as not indexable. Files that
+      could not be tokenized (binary, e.g. UTF-16, or undecodable) are listed, as they are not counted.
+    - The preview lists, per file, each token containing the search text with its count and line numbers.
+      With 'preview_exact' only tokens equal to the search text are listed.
+
+Note:
+    Deleting the index file simply forces a full re-index. See TokenIndex in sql_file_utils.py for details.
+"""
+import time
+from sql_file_utils import TokenIndex, find_sql_files, fold_case
+
+def print_keyword_counts(index, keywords):
+    """Print the number of occurrences of each keyword per file, and in total."""
+    for keyword in keywords:
+        start = time.perf_counter()
+        counts = index.count_keyword(keyword)
+        elapsed = (time.perf_counter() - start) * 1000
+        if counts is None:
+            print(f"{keyword}: cannot be counted from the index (not a single token)")
+            continue
+        print(f"{keyword}: {sum(counts.values())} occurrences in {len(counts)} files ({elapsed:.1f} ms)")
+        for path, count in sorted(counts.items()):
+            print(f"    {count:>8} {path}")
+
+    untokenized = index.untokenized_files()
+    if keywords and untokenized:
+        print(f"{len(untokenized)} files could not be tokenized (binary or undecodable) and are not counted:")
+        for path in sorted(untokenized):
+            print(f"    {path}")
+
+def print_replace_preview(index, search, replacement, exact=False):
+    """Print every file and line where 'search' occurs, with the token as it would read after the replacement."""
+    search_folded = fold_case(search)
+    files = set()
+    total = 0
+    for path, token, count, lines in index.occurrences(search, exact):
+        files.add(path)
+        total += token.count(search_folded) * count
+        new_token = token.replace(search_folded, replacement)
+        print(f"{path}: {token} -> {new_token} ({count}x, lines {', '.join(map(str, lines))})")
+    print(f"Would replace {total} occurrences of '{search}' in {len(files)} files")
+
+def main(index_file, directories, encodings, workers=1, count_keywords=(), preview_search=None, preview_replacement='',
+         preview_exact=False):
+    """Update the token index for the directories, then print the keyword counts and the replace preview."""
+    with TokenIndex(index_file) as index:
+        start = time.perf_counter()
+        counts = index.update(find_sql_files(directories), directories, encodings, workers)
+        print(f"Index updated in {time.perf_counter() - start:.1f}s: {counts['indexed']} files indexed, "
+              f"{counts['unchanged']} unchanged, {counts['removed']} removed")
+
+        print_keyword_counts(index, count_keywords)
+        if preview_search:
+            print_replace_preview(index, preview_search, preview_replacement, preview_exact)
+
+# Configuration
+index_file = r'C:\BabelfishCompass\Python Scripts\Output\token_index.db'
+directories = []
+encodings = ['utf-8-sig', 'utf-8', 'latin-1']
+workers = 1  # Number of worker processes used to tokenize changed files
+count_keywords = ['NOLOCK']  # Keywords to count per file
+preview_search = None  # e.g. 'bsav2_' to preview a replacement
+preview_replacement = ''
+preview_exact = False  # Set to True to only match whole tokens
+
+if __name__ == "__main__":
+    main(index_file, directories, encodings, workers, count_keywords, preview_search, preview_replacement, preview_exact)
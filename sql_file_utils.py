@@ -0,0 +1,1047 @@
+"""
+Shared SQL File Utilities
+
+Description:
+    Helper functions and classes shared by the scripts in this repository. The scripts import this
+    module directly, so keep it in the same directory as the scripts that use it.
+
+Features:
+    - find_sql_files / find_files / iter_file_entries: lazy file discovery built on os.scandir. Files are
+      yielded as soon as their directory is listed, in a stable order (directories top-down, entries
+      sorted by name). Overlapping roots and symlinked duplicates are only walked once, and an optional
+      thread pool lists directories ahead of time for slow network shares.
+    - ScanCache: a persistent on-disk manifest of per-file analysis results. Entries are keyed by
+      file path, size and modification time (optionally a content hash), so re-runs only analyze
+      files that changed. Each analyzer stores a signature of its version and configuration; when
+      the signature changes, that analyzer's entries are discarded automatically.
+
+    - KeywordMatcher: counts many keywords case-insensitively in a single pass, either over text or
+      directly over the bytes of a memory-mapped file in fixed-size chunks (bounded memory for very
+      large SQL dumps).
+    - strip_sql_comments / iter_create_statements / iter_object_references: a statement-level scanner for
+      T-SQL. CREATE statements are found with a substring search for candidates and one compiled,
+      case-insensitive statement pattern, also when written in lowercase or split across lines, and
+      statements in comments are skipped. Blanking out comments and string literals (keeping line numbers)
+      lets another pattern find the (schema-qualified, bracketed or quoted) object names the code uses after
+      FROM, JOIN, INTO, UPDATE, EXEC, REFERENCES, ON and similar keywords.
+    - TokenIndex: a persistent inverted index (SQLite) from case-folded SQL tokens (identifiers, keywords,
+      @variables, #temp tables) to per-file postings with an occurrence count and delta-encoded line numbers.
+      Updates are incremental, like ScanCache. It lists the files that can contain a text, counts single-token
+      keywords and shows the lines a token occurs on without reading the files.
+    - is_valid_utf8: incremental UTF-8 validation of a buffer without decoding it all at once.
+    - read_text / detect_encoding: read a file's bytes once and pick the first encoding of a fallback list
+      that can decode it (the same choice as reopening the file with each encoding in turn). The choice
+      is remembered per file for the rest of the run, so later steps skip detection.
+    - copy_file_tail: copy the rest of a file from a byte offset in constant memory, using the kernel's
+      copy_file_range/sendfile where available.
+    - rewrite_files / atomic_writer: rewrite files in place through a thread or process pool. Writes go to
+      a temporary file that replaces the original with os.replace, files whose bytes would not change are
+      never written, and a dry-run mode reports the changes without touching disk.
+
+Note:
+    The cache is a SQLite database created on first use. Deleting the file simply forces a full re-scan.
+"""
+
+import os
+import re
+import mmap
+import json
+import codecs
+import locale
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+from itertools import repeat
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+def _list_directory(path):
+    """List a directory once, returning its identity, the file entries and the subdirectory paths."""
+    try:
+        stat = os.stat(path)
+        # st_ino is 0 on file systems without inode numbers; fall back to the resolved path
+        key = (stat.st_dev, stat.st_ino) if stat.st_ino else os.path.normcase(os.path.realpath(path))
+        with os.scandir(path) as scanner:
+            entries = sorted(scanner, key=lambda entry: entry.name)
+    except OSError:
+        return None, [], []
+
+    files, subdirectories = [], []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file():
+                files.append(entry)
+        except OSError:
+            continue
+    return key, files, subdirectories
+
+def iter_file_entries(directories, extensions=('.sql',), threads=0):
+    """
+    Yield an os.DirEntry for every file under the given directories whose name ends with one of the
+    extensions (all files when 'extensions' is None). The DirEntry objects carry the stat data from the
+    directory listing, so callers can use entry.stat() without another system call on most platforms.
+
+    Like os.walk, symbolic links to directories are not followed. A directory reachable from several
+    roots (nested roots, or roots that are symlinks to the same place) is only walked once. With
+    'threads' above 1, subdirectories are listed ahead of time in a thread pool while the files of
+    the current directory are being yielded; the order of the results does not change.
+    """
+    extensions = tuple(extensions) if extensions else None
+    executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    visited = set()
+
+    def submit(path):
+        return executor.submit(_list_directory, path) if executor else path
+
+    def listing(job):
+        return job.result() if executor else _list_directory(job)
+
+    try:
+        for directory in directories:
+            stack = [submit(directory)]
+            while stack:
+                key, files, subdirectories = listing(stack.pop())
+                if key is None or key in visited:
+                    continue
+                visited.add(key)
+
+                # Queue the subdirectories first so a thread pool can list them while we yield
+                stack.extend(reversed([submit(path) for path in subdirectories]))
+                for entry in files:
+                    if extensions is None or entry.name.endswith(extensions):
+                        yield entry
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def find_files(directories, extensions=('.sql',), threads=0):
+    """Yield the paths of all files under the given directories with one of the extensions (all files when None)."""
+    for entry in iter_file_entries(directories, extensions, threads):
+        yield entry.path
+
+def find_sql_files(directories, threads=0):
+    """Yield the paths of all .sql files under the given directories."""
+    return find_files(directories, ('.sql',), threads)
+
+def fold_case(text):
+    """
+    Fold text the way a case-insensitive search of the upper-cased text compares it (as SQL Sleuth
+    does): upper-case first, so e.g. a dotless 'i', a long 's' and a sharp 's' become 'I', 'S' and 'SS',
+    then lower-case. A dotted capital 'I' is mapped to 'I' first, because re.IGNORECASE matches it with
+    'i' while str.lower() expands it to two characters.
+    """
+    return text.upper().replace('\u0130', 'I').lower()
+
+# Non-ASCII characters that a case-insensitive search of upper-cased text finds as ASCII letters: str.upper()
+# turns them into ASCII (e.g. a dotless 'i', a long 's', a sharp 's' or the 'fi' ligature), or re.IGNORECASE
+# matches them with one (a dotted capital I, the KELVIN SIGN). Found by checking every code point.
+ASCII_FOLDING_CHARACTERS = ('\u00df\u0130\u0131\u0149\u017f\u01f0\u1e96\u1e97\u1e98\u1e99\u1e9a\u212a'
+                            '\ufb00\ufb01\ufb02\ufb03\ufb04\ufb05\ufb06')
+
+class KeywordMatcher:
+    """
+    Counts every configured keyword in a single pass over the file content.
+
+    The keywords are compiled once into a trie-shaped regular expression inside a lookahead,
+    so each position in the text reports the longest keyword starting there. Any shorter keyword
+    starting at the same position is a prefix of that match, so the per-keyword totals can be
+    rebuilt from one Counter of the longest matches.
+
+    re.findall counts non-overlapping matches, so a keyword that can overlap itself ('--' in '---')
+    also gets an "overlap witness" pattern (e.g. '---'). Only when a witness is found in a file is
+    that single keyword recounted with the original regex, which keeps the counts identical to a
+    per-keyword re.findall loop.
+
+    count() works on upper-cased text. count_file() memory-maps the file and scans its bytes in
+    chunks with an ASCII case-insensitive pattern. That pattern cannot see non-ASCII letters that the
+    upper-cased search counts as ASCII ones (ASCII_FOLDING_CHARACTERS), so a file containing one of
+    them, in the platform's default encoding, is read as text and counted with count() instead; so is
+    every file when a keyword is not ASCII. The counts are then the same as count() on the text read
+    with the default encoding, except for an empty keyword, which counts bytes instead of characters.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # Keywords are case-folded like re.IGNORECASE compares the upper-cased text (see fold_case), so
+        # keywords and matches that only differ in case, e.g. 'IN' and a dotted capital I followed by
+        # 'N', share one trie branch and one total
+        self.terms = {fold_case(keyword) for keyword in self.keywords if keyword}
+
+        # Keyword -> strings that only occur where two occurrences of the keyword overlap
+        self.witnesses = {}
+        for term in self.terms:
+            borders = [size for size in range(1, len(term)) if term[:size] == term[-size:]]
+            if borders:
+                self.witnesses[term] = [term[:len(term) - size] + term for size in borders]
+
+        alternatives = set(self.terms)
+        for witnesses in self.witnesses.values():
+            alternatives.update(witnesses)
+
+        # Longest match -> every alternative that is a prefix of it (including itself)
+        self.prefixes = {
+            alternative: [alternative[:size] for size in range(1, len(alternative) + 1)
+                          if alternative[:size] in alternatives]
+            for alternative in alternatives
+        }
+        self.canonical = {fold_case(alternative): alternative for alternative in alternatives}
+        self.max_length = max((len(alternative.encode('utf-8')) for alternative in alternatives), default=0)
+        self.pattern = self._compile(alternatives) if alternatives else None
+        self.exact_patterns = {}
+
+        # Byte-level variant for count_file(); only used when every keyword is ASCII
+        self.byte_terms = {alternative.encode('ascii'): alternative for alternative in alternatives if alternative.isascii()}
+        self.byte_canonical = {key.lower(): alternative for key, alternative in self.byte_terms.items()}
+        self.byte_pattern = None
+        if alternatives and len(self.byte_terms) == len(alternatives):
+            byte_alternatives = {key.decode('ascii') for key in self.byte_terms}
+            self.byte_pattern = re.compile(self._compile(byte_alternatives).pattern.encode('ascii'), re.IGNORECASE)
+
+        # Files containing one of these byte sequences are counted as text (see count_file)
+        encoding = locale.getpreferredencoding(False)
+        sequences = set()
+        for char in ASCII_FOLDING_CHARACTERS:
+            try:
+                sequences.add(char.encode(encoding))
+            except UnicodeEncodeError:
+                pass
+        self.folding_pattern = re.compile(b'|'.join(map(re.escape, sorted(sequences)))) if sequences else None
+
+    def _compile(self, alternatives):
+        trie = {}
+        for alternative in alternatives:
+            node = trie
+            for char in alternative:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        return re.compile(f"(?=({self._trie_to_regex(trie)}))", re.IGNORECASE)
+
+    def _trie_to_regex(self, node):
+        """Convert a character trie into a regex that matches the longest keyword at a position."""
+        branches = [re.escape(char) + self._trie_to_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if '' in node:
+            return f"(?:{'|'.join(branches)})?"
+        if len(branches) == 1:
+            return branches[0]
+        return f"(?:{'|'.join(branches)})"
+
+    def _add_hits(self, totals, hits, canonical, fold):
+        for match, count in hits.items():
+            if count:
+                for term in self.prefixes[canonical.get(fold(match), match)]:
+                    totals[term] += count
+
+    def _result(self, totals, recount, length):
+        for term, witnesses in self.witnesses.items():
+            if totals[term] and any(totals[witness] for witness in witnesses):
+                totals[term] = recount(term)
+
+        # An empty keyword matches at every position, exactly like re.findall('')
+        return {keyword: totals[fold_case(keyword)] if keyword else length + 1 for keyword in self.keywords}
+
+    def _exact_pattern(self, term, as_bytes=False):
+        key = (term, as_bytes)
+        if key not in self.exact_patterns:
+            literal = term.encode('utf-8') if as_bytes else term
+            self.exact_patterns[key] = re.compile(re.escape(literal), re.IGNORECASE)
+        return self.exact_patterns[key]
+
+    def count(self, content):
+        """Return a dictionary of keyword -> number of occurrences in the upper-cased content."""
+        totals = Counter()
+        if self.pattern is not None:
+            self._add_hits(totals, Counter(self.pattern.findall(content)), self.canonical, fold_case)
+
+        return self._result(totals, lambda term: len(self._exact_pattern(term).findall(content)), len(content))
+
+    def count_file(self, file_path, chunk_size=4 * 1024 * 1024):
+        """
+        Return a dictionary of keyword -> number of occurrences in the file, scanning a memory map of
+        its bytes one chunk at a time. Each chunk is searched with a window extended by the longest
+        keyword so matches crossing a chunk boundary are found, and matches starting in that overlap
+        are subtracted again so they are only counted by the next chunk. Files the byte pattern cannot
+        count like count() (see the class docstring) are read as text with the platform's default
+        encoding instead.
+        """
+        with open(file_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0 or self.pattern is None:
+                return self._result(Counter(), lambda term: 0, size)
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if self.byte_pattern is None or (self.folding_pattern and self.folding_pattern.search(buffer)):
+                    return self._count_text_file(file_path)
+
+                totals = Counter()
+                overlap = self.max_length - 1
+                for start in range(0, size, chunk_size):
+                    end = min(start + chunk_size, size)
+                    window_end = min(end + overlap, size)
+                    hits = Counter(self.byte_pattern.findall(buffer, start, window_end))
+                    if window_end > end:
+                        hits.subtract(Counter(self.byte_pattern.findall(buffer, end, window_end)))
+                    self._add_hits(totals, hits, self.byte_canonical, bytes.lower)
+
+                recount = lambda term: sum(1 for _ in self._exact_pattern(term, as_bytes=True).finditer(buffer))
+                return self._result(totals, recount, size)
+
+    def _count_text_file(self, file_path):
+        """Count the keywords in the upper-cased text of the file, read with the platform's default encoding."""
+        with open(file_path, 'r') as file:
+            return self.count(file.read().upper())
+
+# Comments, string literals and delimited identifiers in T-SQL. Delimited identifiers are matched too,
+# so '--' or a quote inside [brackets] is not mistaken for the start of a comment or a string.
+SQL_COMMENT_OR_STRING = re.compile(r"--[^\n]*|/\*.*?(?:\*/|\Z)|'[^']*(?:''[^']*)*(?:'|\Z)|(\[[^\]]*(?:\]\][^\]]*)*\]|\"[^\"\n]*\")",
+                                   re.DOTALL)
+SQL_BRACKETED_IDENTIFIER = re.compile(r"\[[^\]]*(?:\]\][^\]]*)*\]")
+# Text that can start a comment, a string literal or a quoted identifier
+SQL_SPAN_START = re.compile(r"'|\"|--|/\*")
+
+SQL_IDENTIFIER = r'(?:\[(?:[^\]]|\]\])+\]|"[^"\n]+"|[A-Za-z_@#][\w@#$]*)'
+SQL_QUALIFIED_NAME = rf'{SQL_IDENTIFIER}(?:\s*\.\s*{SQL_IDENTIFIER}){{0,3}}'
+
+# CREATE [OR ALTER | OR REPLACE] [UNIQUE] [CLUSTERED | NONCLUSTERED] [COLUMNSTORE] <type> <name>
+CREATE_STATEMENT = re.compile(
+    r'CREATE\s+(?:OR\s+(?:ALTER|REPLACE)\s+)?(?:UNIQUE\s+)?(?:(?:NON)?CLUSTERED\s+)?(?:COLUMNSTORE\s+)?'
+    r'(TYPE|TABLE|VIEW|FUNCTION|SYNONYM|PROCEDURE|PROC|SEQUENCE|TRIGGER|INDEX|SCHEMA)\s+'
+    rf'({SQL_QUALIFIED_NAME})', re.IGNORECASE)
+CREATE_KEYWORD = re.compile(r'CREATE', re.IGNORECASE)
+# A name in an object position: after FROM, JOIN, INTO, UPDATE, EXEC, REFERENCES, ... or the table after ON in
+# CREATE INDEX/TRIGGER (followed by '(' or FOR/AFTER/INSTEAD OF/WITH; a join condition is not a reference). The
+# name is matched in a lookahead, so 'INSERT INTO dbo.t' yields both 'INTO' (discarded as a keyword) and 'dbo.t'.
+OBJECT_REFERENCE = re.compile(
+    r'(?<![\w@#$.])(?:(?:FROM|JOIN|INTO|UPDATE|INSERT|DELETE|MERGE|REFERENCES|ALTER\s+TABLE|'
+    r'EXEC(?:UTE)?(?:\s+@[\w@#$]+\s*=)?)\s+(?=({0}))|'
+    r'ON\s+(?=({0})\s*(?:\(|(?:FOR|AFTER|INSTEAD|WITH)\b)))'.format(SQL_QUALIFIED_NAME), re.IGNORECASE)
+# Keywords that can follow the words above but never name an object, e.g. 'ON DELETE CASCADE', 'ON [PRIMARY]' is
+# a filegroup. Only unquoted names are compared with this list.
+SQL_NON_OBJECT_WORDS = {'all', 'as', 'cascade', 'default', 'delete', 'distinct', 'from', 'insert', 'into', 'no', 'of',
+                        'primary', 'select', 'set', 'statistics', 'top', 'update', 'values', 'with'}
+SQL_NAME_PART = re.compile(SQL_IDENTIFIER)
+SQL_WORD_CHARACTERS = '_@#$'
+
+def strip_sql_comments(text):
+    """
+    Blank out comments and string literals so they are not scanned as code. Line breaks are kept,
+    so line numbers in the result match the original text.
+    """
+    def blank(match):
+        if match.group(1):
+            return match.group(1)
+        return '\n' * match.group(0).count('\n') or ' '
+    return SQL_COMMENT_OR_STRING.sub(blank, text)
+
+def normalize_object_name(name):
+    """Normalize a possibly bracketed or quoted, schema-qualified name: '[dbo].[Foo]' -> 'dbo.foo'."""
+    parts = []
+    for part in SQL_NAME_PART.findall(name):
+        if part[0] == '[':
+            part = part[1:-1].replace(']]', ']')
+        elif part[0] == '"':
+            part = part[1:-1]
+        parts.append(part.lower())
+    return '.'.join(parts)
+
+def _create_keyword_positions(text):
+    """Yield the position of every case-insensitive 'CREATE' in the text."""
+    upper = text.upper()
+    if len(upper) != len(text):
+        # Upper-casing changed the length (e.g. 'ß' -> 'SS'), so positions would not line up
+        yield from (match.start() for match in CREATE_KEYWORD.finditer(text))
+        return
+    position = upper.find('CREATE')
+    while position != -1:
+        yield position
+        position = upper.find('CREATE', position + 6)
+
+def _span_at(text, start, position):
+    """
+    Return the match of the comment, string literal or delimited identifier that contains 'position',
+    or None if 'position' is in code. 'start' must be a position outside all of them. Only the places
+    that can start a comment or string are matched with SQL_COMMENT_OR_STRING; a bracketed identifier
+    is only matched when it might contain such a place or 'position' itself.
+    """
+    while True:
+        marker = SQL_SPAN_START.search(text, start, position)
+        limit = marker.start() if marker else position
+        bracket = text.rfind('[', start, limit)
+        if bracket != -1:
+            identifier = SQL_BRACKETED_IDENTIFIER.match(text, bracket)
+            if identifier is not None and identifier.end() > limit:
+                if identifier.end() > position:
+                    return identifier
+                # The marker is part of the identifier
+                start = identifier.end()
+                continue
+        if marker is None:
+            return None
+        span = SQL_COMMENT_OR_STRING.match(text, limit)
+        if span is None:
+            # A double quote that is not closed on the same line
+            start = limit + 1
+            continue
+        if span.end() > position:
+            return span
+        start = span.end()
+
+def iter_create_statements(text):
+    """
+    Yield (object_type, object_name, line_number) for every CREATE statement in SQL text, also when
+    written in lowercase or split across lines. Candidates are located with a plain substring search
+    and only then matched against the compiled statement pattern, so text without CREATE costs one
+    pass. Statements in comments and delimited identifiers are skipped; those in string literals
+    (dynamic SQL) are reported when the statement head lies inside the literal. Comments and strings
+    are located with SQL_COMMENT_OR_STRING, but only where the text since the previous candidate
+    contains something that could start one (see _span_at).
+    Types are lower-case ('proc' is reported as 'procedure', every index variant as 'index'); names
+    are normalized. Temporary tables (#name) are skipped.
+    """
+    line_number, line_position = 1, 0
+    # The comment or string containing the previous candidate, and a position known to be outside one
+    span, resume = None, 0
+    for position in _create_keyword_positions(text):
+        if position and (text[position - 1].isalnum() or text[position - 1] in SQL_WORD_CHARACTERS):
+            continue
+        if span is None or position >= span.end():
+            if span is not None:
+                resume = span.end()
+            span = _span_at(text, resume, position)
+            if span is None:
+                resume = position
+
+        end_position = len(text)
+        if span is not None:
+            if text[span.start()] != "'":
+                # Inside a comment or a delimited identifier
+                continue
+            # Dynamic SQL: the statement must not run past the end of the string literal
+            end_position = span.end()
+        match = CREATE_STATEMENT.match(text, position, end_position)
+        if not match:
+            continue
+        object_name = normalize_object_name(match.group(2))
+        if object_name.startswith('#'):
+            continue
+        line_number += text.count('\n', line_position, position)
+        line_position = position
+        object_type = match.group(1).lower()
+        yield ('procedure' if object_type == 'proc' else object_type), object_name, line_number
+
+def iter_object_references(code):
+    """
+    Yield the normalized (possibly schema-qualified) names in object positions of code returned by
+    strip_sql_comments: the tables, views and procedures after FROM, JOIN, INTO, UPDATE, INSERT, DELETE,
+    MERGE, EXEC, REFERENCES and ALTER TABLE, and the table of CREATE INDEX/TRIGGER ... ON. Column names, aliases and other identifiers are not
+    references. Variables and temporary tables (@name, #name) are skipped.
+    """
+    for match in OBJECT_REFERENCE.finditer(code):
+        name = match.group(1) or match.group(2)
+        if name[0] in '@#' or (name[0] not in '["' and name.lower() in SQL_NON_OBJECT_WORDS):
+            continue
+        yield normalize_object_name(name)
+
+def is_valid_utf8(buffer, chunk_size=4 * 1024 * 1024):
+    """Check whether a bytes-like buffer (e.g. an mmap) is valid UTF-8, decoding one chunk at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for start in range(0, len(buffer), chunk_size):
+            decoder.decode(buffer[start:start + chunk_size])
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+# Encoding chosen for each file during this run, keyed by path, size, modification time and candidate list
+encoding_cache = {}
+
+UTF8_NAMES = ('utf-8', 'utf-8-sig')
+
+def _encoding_cache_key(file_path, encodings):
+    stat = os.stat(file_path)
+    return (file_path, stat.st_size, stat.st_mtime_ns, tuple(encodings))
+
+def _can_decode(buffer, encoding, chunk_size=4 * 1024 * 1024):
+    """Check whether the whole buffer decodes with the given encoding, one chunk at a time."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        for start in range(0, len(buffer), chunk_size):
+            decoder.decode(buffer[start:start + chunk_size])
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def _first_valid_encoding(buffer, encodings):
+    """
+    Return the first encoding that can decode the buffer, or None. UTF-8 validity is checked once for
+    both 'utf-8' and 'utf-8-sig' (a BOM is valid UTF-8), and latin-1 is accepted without decoding
+    because every byte sequence is valid latin-1.
+    """
+    utf8_valid = None
+    for encoding in encodings:
+        name = codecs.lookup(encoding).name
+        if name in UTF8_NAMES:
+            if utf8_valid is None:
+                utf8_valid = is_valid_utf8(buffer)
+            if utf8_valid:
+                return encoding
+        elif name == 'iso8859-1' or _can_decode(buffer, encoding):
+            return encoding
+    return None
+
+def detect_encoding(file_path, encodings=('utf-8-sig', 'utf-8', 'latin-1')):
+    """
+    Return the first encoding in 'encodings' that can decode the file, the same choice as opening the
+    file with each encoding in turn. The file is memory-mapped and validated chunk by chunk, so memory
+    stays bounded. Raises ValueError if no encoding works.
+    """
+    key = _encoding_cache_key(file_path, encodings)
+    if key in encoding_cache:
+        return encoding_cache[key]
+
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            encoding = encodings[0] if encodings else None
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                encoding = _first_valid_encoding(buffer, encodings)
+    if encoding is None:
+        raise ValueError(f"Failed to decode {file_path} with given encodings.")
+
+    encoding_cache[key] = encoding
+    return encoding
+
+def decode_bytes(data, encodings=('utf-8-sig', 'utf-8', 'latin-1'), file_path=None):
+    """
+    Decode bytes read from a file with the first encoding in 'encodings' that works. Returns the text
+    and the encoding used. Line endings are translated to '\n' like a file opened in text mode. When
+    'file_path' is given, the choice is remembered for the rest of the run. Raises ValueError if no
+    encoding works.
+    """
+    key = _encoding_cache_key(file_path, encodings) if file_path else None
+    text = None
+    encoding = encoding_cache.get(key)
+    if encoding is not None:
+        try:
+            text = data.decode(encoding)
+        except UnicodeDecodeError:
+            encoding = None
+
+    if text is None:
+        utf8_failed = False
+        for candidate in encodings:
+            name = codecs.lookup(candidate).name
+            if name in UTF8_NAMES and utf8_failed:
+                continue
+            try:
+                text = data.decode(candidate)
+                encoding = candidate
+                break
+            except UnicodeDecodeError:
+                utf8_failed = utf8_failed or name in UTF8_NAMES
+        else:
+            raise ValueError(f"Failed to decode {file_path or 'data'} with given encodings.")
+        if key:
+            encoding_cache[key] = encoding
+
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, encoding
+
+def read_text(file_path, encodings=('utf-8-sig', 'utf-8', 'latin-1')):
+    """
+    Read a file's bytes once and decode them with the first encoding in 'encodings' that works.
+    Returns the text and the encoding used (see decode_bytes). Raises ValueError if no encoding works.
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    return decode_bytes(data, encodings, file_path)
+
+def encode_text(text, encoding):
+    """Encode text the way a file opened in text mode would write it ('\n' becomes os.linesep)."""
+    if os.linesep != '\n':
+        text = text.replace('\n', os.linesep)
+    return text.encode(encoding)
+
+@contextmanager
+def atomic_writer(file_path, durable=False):
+    """
+    Open a temporary file next to 'file_path' for binary writing and move it over 'file_path' with
+    os.replace once the block completes. If anything fails the original file is left untouched. The
+    file mode of an existing file is preserved. With 'durable' the data is fsync'ed before the swap.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            yield file
+            if durable:
+                file.flush()
+                os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def copy_file_tail(source, target, offset, block_size=1024 * 1024):
+    """
+    Copy everything from byte 'offset' to the end of the open binary file 'source' into the open binary
+    file 'target', in constant memory. The kernel copies the data directly where supported
+    (os.copy_file_range, then os.sendfile); otherwise it is copied in blocks.
+    """
+    target.flush()
+    size = os.fstat(source.fileno()).st_size
+    target_offset = target.tell()
+
+    for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if copy is None:
+            continue
+        position = offset
+        try:
+            if copy is os.sendfile:
+                os.lseek(target.fileno(), target_offset, os.SEEK_SET)
+            while position < size:
+                if copy is os.sendfile:
+                    copied = copy(target.fileno(), source.fileno(), position, min(size - position, 1 << 30))
+                else:
+                    copied = copy(source.fileno(), target.fileno(), min(size - position, 1 << 30), position,
+                                  target_offset + position - offset)
+                if copied == 0:
+                    break
+                position += copied
+        except OSError:
+            continue
+        if position >= size:
+            target.seek(target_offset + size - offset)
+            return
+
+    # Fall back to copying through Python in blocks
+    source.seek(offset)
+    target.seek(target_offset)
+    target.truncate()
+    for block in iter(lambda: source.read(block_size), b''):
+        target.write(block)
+
+def _rewrite_file(file_path, transform, dry_run):
+    """Rewrite one file for rewrite_files, returning (file_path, status, error)."""
+    try:
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        new_data = transform(file_path, data)
+        if new_data is None or new_data == data:
+            return file_path, 'unchanged', None
+        if dry_run:
+            return file_path, 'would update', None
+        with atomic_writer(file_path) as file:
+            file.write(new_data)
+        return file_path, 'updated', None
+    except Exception as e:
+        return file_path, 'error', e
+
+def rewrite_files(file_paths, transform, workers=1, use_processes=False, dry_run=False):
+    """
+    Rewrite files in place through a thread pool (or a process pool with 'use_processes').
+
+    'transform(file_path, data)' receives the current bytes of a file and returns the new bytes, or None
+    to leave the file alone. Files whose new bytes are identical to the current ones are never written,
+    and changed files are replaced atomically (temporary file plus os.replace), so an interrupted run
+    never leaves a truncated file behind. With 'dry_run' nothing is written and changed files are
+    reported as 'would update'. For a process pool the transform must be picklable, e.g. a module-level
+    function wrapped in functools.partial.
+
+    Yields (file_path, status, error) in input order, where status is 'updated', 'would update',
+    'unchanged' or 'error'.
+    """
+    if workers <= 1:
+        for file_path in file_paths:
+            yield _rewrite_file(file_path, transform, dry_run)
+        return
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        yield from executor.map(_rewrite_file, file_paths, repeat(transform), repeat(dry_run), chunksize=16 if use_processes else 1)
+
+def make_signature(version, *config):
+    """Build a signature from an analyzer version and its configuration (e.g. the keyword list)."""
+    return hashlib.sha256(json.dumps([version, *config], default=str).encode('utf-8')).hexdigest()
+
+def file_digest(file_path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ScanCache:
+    """
+    Persistent cache of per-file analysis results for one analyzer.
+
+    Usage:
+        with ScanCache(cache_file, 'sql_sleuth', make_signature(1, keywords)) as cache:
+            result = cache.get(file_path)
+            if result is None:
+                result = analyze(file_path)
+                cache.put(file_path, result)
+
+    Results must be JSON serializable. With 'use_hash' a file whose size or modification time changed
+    is still served from the cache when its content hash is unchanged (e.g. after a fresh checkout).
+    """
+
+    def __init__(self, cache_file, analyzer, signature, use_hash=False, commit_every=1000):
+        self.analyzer = analyzer
+        self.use_hash = use_hash
+        self.commit_every = commit_every
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(cache_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS analyzers (name TEXT PRIMARY KEY, signature TEXT NOT NULL)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                                 analyzer TEXT NOT NULL,
+                                 path     TEXT NOT NULL,
+                                 size     INTEGER NOT NULL,
+                                 mtime_ns INTEGER NOT NULL,
+                                 digest   TEXT,
+                                 result   TEXT NOT NULL,
+                                 PRIMARY KEY (analyzer, path))""")
+
+        # Invalidate this analyzer's results when its version or configuration changed
+        row = self.conn.execute("SELECT signature FROM analyzers WHERE name = ?", (analyzer,)).fetchone()
+        if row is None or row[0] != signature:
+            self.conn.execute("DELETE FROM results WHERE analyzer = ?", (analyzer,))
+            self.conn.execute("INSERT OR REPLACE INTO analyzers (name, signature) VALUES (?, ?)", (analyzer, signature))
+            self.conn.commit()
+
+    def get(self, file_path, stat=None):
+        """Return the cached result for a file, or None if the file is new or has changed."""
+        stat = stat or os.stat(file_path)
+        row = self.conn.execute("SELECT size, mtime_ns, digest, result FROM results WHERE analyzer = ? AND path = ?",
+                                (self.analyzer, file_path)).fetchone()
+        if row is not None:
+            size, mtime_ns, digest, result = row
+            if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                self.hits += 1
+                return json.loads(result)
+            if self.use_hash and digest and size == stat.st_size and digest == file_digest(file_path):
+                # Same content with a new timestamp: refresh the entry instead of re-analyzing
+                self.conn.execute("UPDATE results SET mtime_ns = ? WHERE analyzer = ? AND path = ?",
+                                  (stat.st_mtime_ns, self.analyzer, file_path))
+                self._count_write()
+                self.hits += 1
+                return json.loads(result)
+        self.misses += 1
+        return None
+
+    def put(self, file_path, result, stat=None):
+        """Store the result for a file along with its current size and modification time."""
+        stat = stat or os.stat(file_path)
+        digest = file_digest(file_path) if self.use_hash else None
+        self.conn.execute("INSERT OR REPLACE INTO results (analyzer, path, size, mtime_ns, digest, result) VALUES (?, ?, ?, ?, ?, ?)",
+                          (self.analyzer, file_path, stat.st_size, stat.st_mtime_ns, digest, json.dumps(result)))
+        self._count_write()
+
+    def _count_write(self):
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# A token is a maximal run of identifier characters, so '@OrderId', '#temp', 'sp_who2' and 'NOLOCK' are
+# single tokens. Tokens are stored case-folded (see fold_case).
+SQL_TOKEN = re.compile(r'[\w@#$]+')
+
+# Bump when the tokenizer or the postings format changes so existing indexes are rebuilt
+TOKEN_INDEX_VERSION = 2
+
+def _encode_lines(lines):
+    """Encode an ascending list of line numbers as variable-length deltas (one byte for most lines)."""
+    output = bytearray()
+    previous = 0
+    for line in lines:
+        delta = line - previous
+        previous = line
+        while delta >= 0x80:
+            output.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        output.append(delta)
+    return bytes(output)
+
+def _decode_lines(data):
+    """Decode the line numbers written by _encode_lines."""
+    lines = []
+    line = delta = shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        line += delta
+        lines.append(line)
+        delta = shift = 0
+    return lines
+
+def tokenize_file(file_path, encodings=('utf-8-sig', 'utf-8', 'latin-1')):
+    """
+    Return (stat, digest, encoding, postings) for a file, where postings maps each case-folded token to
+    (number of occurrences, encoded line numbers). Files that cannot be tokenized, binary files (containing
+    NUL bytes, which includes UTF-16 files) and files none of the encodings can decode, get no postings
+    and None as their encoding.
+    """
+    stat = os.stat(file_path)
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if b'\x00' in data[:8192]:
+        return stat, digest, None, {}
+
+    try:
+        text, encoding = decode_bytes(data, encodings, file_path)
+    except ValueError:
+        return stat, digest, None, {}
+    counts, lines = Counter(), {}
+    for line_number, line in enumerate(fold_case(text).split('\n'), start=1):
+        for token in SQL_TOKEN.findall(line):
+            counts[token] += 1
+            token_lines = lines.setdefault(token, [])
+            if not token_lines or token_lines[-1] != line_number:
+                token_lines.append(line_number)
+    return stat, digest, encoding, {token: (count, _encode_lines(lines[token])) for token, count in counts.items()}
+
+def _tokenize_file_safely(file_path, encodings):
+    """Run tokenize_file, returning (file_path, result, error) instead of raising."""
+    try:
+        return file_path, tokenize_file(file_path, encodings), None
+    except Exception as e:
+        return file_path, None, e
+
+class TokenIndex:
+    """
+    Persistent inverted index from SQL tokens (identifiers, keywords, @variables, #temp tables) to
+    the files and lines they occur on, stored in a SQLite database.
+
+    Usage:
+        with TokenIndex(index_file) as index:
+            index.update(find_sql_files(directories), directories)
+            index.candidate_files('usps_zipcodes')    # files that can contain the text
+            index.count_keyword('NOLOCK')             # occurrences per file, without reading the files
+
+    Matching is case-insensitive and folds case like a search of the upper-cased text (see fold_case),
+    so a dotless 'i' or a long 's' is found for INSERT or SELECT just as SQL Sleuth counts it. Comments
+    and string literals are indexed as well, so the index answers the same questions as a plain text
+    search. Text that is not made up of whole tokens (e.g. 'WITH (NOLOCK)') is looked up through its
+    token parts, which gives a superset of the files that contain it. Files that were not tokenized
+    (binary or undecodable, recorded with a NULL encoding) are always returned as candidates, since
+    nothing is known about them. Queries search the (small) token vocabulary first and then read the
+    postings of the matching tokens; CROSS JOIN keeps SQLite from picking the opposite join order.
+    """
+
+    def __init__(self, index_file, commit_every=1000):
+        self.commit_every = commit_every
+        self.conn = sqlite3.connect(index_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS index_info (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                 id       INTEGER PRIMARY KEY,
+                                 path     TEXT NOT NULL UNIQUE,
+                                 size     INTEGER NOT NULL,
+                                 mtime_ns INTEGER NOT NULL,
+                                 digest   TEXT NOT NULL,
+                                 encoding TEXT)""")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (id INTEGER PRIMARY KEY, token TEXT NOT NULL UNIQUE)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS postings (
+                                 token_id INTEGER NOT NULL,
+                                 file_id  INTEGER NOT NULL,
+                                 count    INTEGER NOT NULL,
+                                 lines    BLOB NOT NULL,
+                                 PRIMARY KEY (token_id, file_id)) WITHOUT ROWID""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_by_file ON postings (file_id)")
+
+        # Rebuild the index when the tokenizer changed
+        row = self.conn.execute("SELECT value FROM index_info WHERE name = 'version'").fetchone()
+        if row is None or row[0] != str(TOKEN_INDEX_VERSION):
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM tokens")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("INSERT OR REPLACE INTO index_info (name, value) VALUES ('version', ?)", (str(TOKEN_INDEX_VERSION),))
+            self.conn.commit()
+
+    def update(self, file_paths, directories, encodings=('utf-8-sig', 'utf-8', 'latin-1'), workers=1):
+        """
+        Bring the index up to date: tokenize new and changed files (in a process pool with 'workers'
+        above 1) and remove files below 'directories' that no longer exist. A file whose modification
+        time changed but whose content did not only gets its fingerprint refreshed. Returns a dict
+        with the number of files indexed, unchanged and removed.
+        """
+        known = {path: (file_id, size, mtime_ns, digest) for file_id, path, size, mtime_ns, digest
+                 in self.conn.execute("SELECT id, path, size, mtime_ns, digest FROM files")}
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0}
+        seen, changed = set(), []
+        for file_path in file_paths:
+            seen.add(file_path)
+            stat = os.stat(file_path)
+            fingerprint = known.get(file_path)
+            if fingerprint is not None and fingerprint[1:3] == (stat.st_size, stat.st_mtime_ns):
+                counts['unchanged'] += 1
+            else:
+                changed.append(file_path)
+
+        vocabulary = dict(self.conn.execute("SELECT token, id FROM tokens"))
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(changed) > 1 else None
+        try:
+            if executor:
+                results = executor.map(_tokenize_file_safely, changed, repeat(encodings), chunksize=16)
+            else:
+                results = map(_tokenize_file_safely, changed, repeat(encodings))
+
+            pending = 0
+            for file_path, result, error in results:
+                if error is not None:
+                    print(f"Error indexing {file_path}: {error}")
+                    continue
+                stat, digest, encoding, postings = result
+                fingerprint = known.get(file_path)
+                if fingerprint is not None and fingerprint[3] == digest:
+                    self.conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?",
+                                      (stat.st_size, stat.st_mtime_ns, fingerprint[0]))
+                    counts['unchanged'] += 1
+                else:
+                    self._replace_file(file_path, fingerprint, stat, digest, encoding, postings, vocabulary)
+                    counts['indexed'] += 1
+                pending += 1
+                if pending >= self.commit_every:
+                    self.conn.commit()
+                    pending = 0
+        finally:
+            if executor:
+                executor.shutdown()
+
+        prefixes = tuple(os.path.join(directory, '') for directory in directories)
+        for path, (file_id, _, _, _) in known.items():
+            if path not in seen and path.startswith(prefixes):
+                self.conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+                self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                counts['removed'] += 1
+
+        # Drop tokens that no longer occur in any file
+        if counts['indexed'] or counts['removed']:
+            self.conn.execute("DELETE FROM tokens WHERE NOT EXISTS (SELECT 1 FROM postings WHERE token_id = tokens.id)")
+        self.conn.commit()
+        return counts
+
+    def _replace_file(self, file_path, fingerprint, stat, digest, encoding, postings, vocabulary):
+        """Replace the postings of one file, adding new tokens to the vocabulary."""
+        if fingerprint is None:
+            file_id = self.conn.execute("INSERT INTO files (path, size, mtime_ns, digest, encoding) VALUES (?, ?, ?, ?, ?)",
+                                        (file_path, stat.st_size, stat.st_mtime_ns, digest, encoding)).lastrowid
+        else:
+            file_id = fingerprint[0]
+            self.conn.execute("UPDATE files SET size = ?, mtime_ns = ?, digest = ?, encoding = ? WHERE id = ?",
+                              (stat.st_size, stat.st_mtime_ns, digest, encoding, file_id))
+            self.conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+
+        for token in postings:
+            if token not in vocabulary:
+                vocabulary[token] = self.conn.execute("INSERT INTO tokens (token) VALUES (?)", (token,)).lastrowid
+        self.conn.executemany("INSERT INTO postings (token_id, file_id, count, lines) VALUES (?, ?, ?, ?)",
+                              ((vocabulary[token], file_id, count, lines) for token, (count, lines) in postings.items()))
+
+    def untokenized_files(self):
+        """Return the set of indexed files that could not be tokenized (binary or undecodable)."""
+        return {path for path, in self.conn.execute("SELECT path FROM files WHERE encoding IS NULL")}
+
+    def candidate_files(self, text):
+        """
+        Return the set of indexed files that can contain 'text' (case-insensitively), or None when the
+        index cannot narrow it down. Every file that contains the text is included, and so is every
+        file that could not be tokenized.
+        """
+        parts = SQL_TOKEN.findall(fold_case(text))
+        if not parts:
+            return None
+        files = None
+        for part in parts:
+            found = {path for path, in self.conn.execute("""SELECT DISTINCT f.path
+                                                            FROM tokens t
+                                                            CROSS JOIN postings p ON p.token_id = t.id
+                                                            JOIN files f ON f.id = p.file_id
+                                                            WHERE instr(t.token, ?) > 0""", (part,))}
+            files = found if files is None else files & found
+        return files | self.untokenized_files()
+
+    def candidate_files_any(self, texts):
+        """Return the union of candidate_files over several texts, or None if any text cannot be narrowed down."""
+        files = set()
+        for text in texts:
+            found = self.candidate_files(text)
+            if found is None:
+                return None
+            files |= found
+        return files
+
+    def count_keyword(self, keyword):
+        """
+        Return {file path: occurrences} of a keyword, counted case-insensitively like a text search, from
+        the index alone. Only keywords made up of a single token's characters (e.g. 'NOLOCK', 'sp_', '@Id')
+        can be counted this way; for anything else None is returned. Files that could not be tokenized
+        are not included (see untokenized_files).
+        """
+        keyword = fold_case(keyword)
+        if not keyword or SQL_TOKEN.fullmatch(keyword) is None:
+            return None
+        totals = Counter()
+        for path, token, count in self.conn.execute("""SELECT f.path, t.token, p.count
+                                                       FROM tokens t
+                                                       CROSS JOIN postings p ON p.token_id = t.id
+                                                       JOIN files f ON f.id = p.file_id
+                                                       WHERE instr(t.token, ?) > 0""", (keyword,)):
+            # An occurrence can never span two tokens, so count it within each token
+            totals[path] += token.count(keyword) * count
+        return dict(totals)
+
+    def occurrences(self, text, exact=False):
+        """
+        Yield (file path, token, count, line numbers) for every token containing 'text' (or equal to it
+        with 'exact'), ordered by file path. Useful to preview a replacement without reading the files.
+        """
+        text = fold_case(text)
+        condition = "t.token = ?" if exact else "instr(t.token, ?) > 0"
+        rows = self.conn.execute(f"""SELECT f.path, t.token, p.count, p.lines
+                                     FROM tokens t
+                                     CROSS JOIN postings p ON p.token_id = t.id
+                                     JOIN files f ON f.id = p.file_id
+                                     WHERE {condition}
+                                     ORDER BY f.path, t.token""", (text,))
+        for path, token, count, lines in rows:
+            yield path, token, count, _decode_lines(lines)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()